@@ -1,4 +1,4 @@
 #!/bin/sh
 
 cd ./script
-python3 run_mfcc.py
\ No newline at end of file
+python3 run_mfcc.py "$@"
\ No newline at end of file
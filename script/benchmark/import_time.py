@@ -0,0 +1,25 @@
+import os
+import sys
+import json
+import subprocess
+import numpy as np
+
+#数値計算の本体を読み込んだ時に入っていてはいけない重いモジュール
+HEAVY_MODULES = ["matplotlib", "scipy", "pandas"]
+
+
+def measure_import_time(module, repeat=5):
+    """
+    Import module in fresh interpreter repeat times.
+    Return median import time in seconds and heavy modules loaded by the import.
+    """
+    code = ("import sys, time, json; start = time.perf_counter(); import {}; seconds = time.perf_counter() - start; "
+        "print(json.dumps([seconds, [m for m in {} if m in sys.modules]]))").format(module, HEAVY_MODULES)
+    script_fpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    loaded = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=script_fpath)
+        seconds, loaded = json.loads(output.decode().strip().splitlines()[-1])
+        times.append(seconds)
+    return float(np.median(times)), loaded
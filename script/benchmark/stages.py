@@ -0,0 +1,113 @@
+import time
+import numpy as np
+from mfcc import mfcc
+from mfcc import streaming
+
+def measure(function, repeat):
+    """
+    Get median wall time of function after one warm-up call.
+    """
+    function()
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def benchmark_stages(data, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov, repeat=5):
+    """
+    Time each stage of MFCC for one record, as get_mfcc (N = len(data)) and get_delta_ceps do.
+    fft_fast and mfcc_fast are FFT and MFCC with padding to fast FFT length (fft_length "fast" in config.json).
+    Return dict of stage name and seconds, number of samples and throughput (samples/sec).
+    """
+    N = len(data)
+    plan = mfcc.get_plan(fs, N, numChannels, cutpoint, fo, mel, p_filter)
+    fast_plan = mfcc.get_plan(fs, N, numChannels, cutpoint, fo, mel, p_filter, padding=True)
+    record = np.asarray(data, dtype=float)[np.newaxis, :]
+    emphasized = plan.pre_emphasis(record)
+    windowed = plan.windowing(emphasized)
+    fft_data = plan.fft(windowed)
+    mspec = plan.filterbank_energy(fft_data)
+    frames = mfcc.frame_signal(data, nframe, ov)
+    frame_mfcc = mfcc.batch_mfcc(frames, fs, numChannels, cutpoint, fo, mel, p_filter)
+
+    stage_list = [
+        ("plan", lambda: mfcc.MFCCPlan(fs, N, numChannels, cutpoint, fo, mel, p_filter), N),
+        ("pre_emphasis", lambda: plan.pre_emphasis(record), N),
+        ("windowing", lambda: plan.windowing(emphasized), N),
+        ("fft", lambda: plan.fft(windowed), N),
+        ("fft_fast", lambda: fast_plan.fft(windowed), N),
+        ("filterbank", lambda: plan.filterbank_energy(fft_data), N),
+        ("dct", lambda: plan.dct(mspec), N),
+        ("mfcc", lambda: plan.mfcc(record), N),
+        ("mfcc_fast", lambda: fast_plan.mfcc(record), N),
+        ("framing", lambda: mfcc.frame_signal(data, nframe, ov), N),
+        ("frame_mfcc", lambda: mfcc.batch_mfcc(frames, fs, numChannels, cutpoint, fo, mel, p_filter), frames.size),
+        ("delta", lambda: mfcc.batch_delta_cepstrum(frame_mfcc), frames.size)
+    ]
+    results = {}
+    for name, function, samples in stage_list:
+        seconds = measure(function, repeat)
+        results[name] = {"seconds" : seconds, "samples" : samples, "throughput" : samples / seconds}
+    return results
+
+
+FLOAT32_TOLERANCE = 1e-4 #float64 に対する float32 の誤差の許容値 (最大絶対値に対する比)
+
+
+def compare_dtype(data, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov):
+    """
+    Compare MFCC and delta-cepstrum calculated in float32 with float64 reference, as get_mfcc and get_delta_ceps do.
+    Return dict of feature name and max absolute error relative to max absolute value of the reference.
+    """
+    errors = {}
+    for name in ["mfcc", "delta-ceps"]:
+        features = {}
+        for dtype in [np.float64, np.float32]:
+            if name == "mfcc":
+                features[dtype] = mfcc.MFCCclass(data, fs, len(data), numChannels, cutpoint, fo, mel, p_filter, dtype).mfcc()
+            else:
+                frames = mfcc.frame_signal(data, nframe, ov, dtype)
+                features[dtype] = mfcc.batch_delta_cepstrum(mfcc.batch_mfcc(frames, fs, numChannels, cutpoint, fo, mel, p_filter, dtype))
+        reference = features[np.float64]
+        error = np.max(np.abs(features[np.float32].astype(np.float64) - reference))
+        errors[name] = float(error / max(np.max(np.abs(reference)), np.finfo(np.float64).tiny))
+    return errors
+
+
+STREAMING_TOLERANCE = 1e-12 #フレーム行列の MFCC に対するストリーミングの誤差の許容値 (最大絶対値に対する比)
+STREAMING_CHUNK = 257 #シフトで割り切れないチャンクの長さ
+
+
+def compare_streaming(data, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov, chunk=STREAMING_CHUNK):
+    """
+    Compare MFCC of StreamingMFCC fed with chunks of data with batch_mfcc of frame_signal of whole data.
+    Each streaming frame is calculated alone, so the last bits can differ from the batched matrix products.
+    Return max absolute error relative to max absolute value of the offline MFCC, or inf if numbers of frames differ.
+    """
+    reference = mfcc.batch_mfcc(mfcc.frame_signal(data, nframe, ov), fs, numChannels, cutpoint, fo, mel, p_filter)
+    stream = streaming.StreamingMFCC(fs, nframe, ov, numChannels, cutpoint, fo, mel, p_filter)
+    ceps = np.concatenate([stream.push(data[start:start + chunk]) for start in range(0, len(data), chunk)])
+    if ceps.shape != reference.shape:
+        return float("inf")
+    if len(reference) == 0:
+        return 0.0
+    error = np.max(np.abs(ceps - reference))
+    return float(error / max(np.max(np.abs(reference)), np.finfo(np.float64).tiny))
+
+
+def compare_results(baseline, result, tolerance):
+    """
+    Compare throughput of each stage with baseline.
+    Return list of [stage name, baseline throughput, throughput, ratio, regression flag].
+    Regression is throughput lower than (1 - tolerance) * baseline.
+    """
+    comparison = []
+    for name in baseline:
+        if name not in result:
+            continue
+        ratio = result[name]["throughput"] / baseline[name]["throughput"]
+        comparison.append([name, baseline[name]["throughput"], result[name]["throughput"], ratio, ratio < 1 - tolerance])
+    return comparison
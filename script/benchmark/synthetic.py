@@ -0,0 +1,60 @@
+import os
+import numpy as np
+
+def next_prime(n):
+    """
+    Get the smallest prime number >= n. Prime length is the slowest case of FFT.
+    """
+    def is_prime(m):
+        if m < 2:
+            return False
+        i = 2
+        while i * i <= m:
+            if m % i == 0:
+                return False
+            i += 1
+        return True
+
+    while not is_prime(n):
+        n += 1
+    return n
+
+
+def generate_infrasound(length, fs, signal=True, seed=None):
+    """
+    Generate synthetic infrasound: microbarom, low-frequency drift and sensor noise.
+    If signal is True, a decaying pulse like a volcanic explosion is added.
+    Return times, data.
+    """
+    rng = np.random.default_rng(seed)
+    times = np.arange(length) / fs
+    nyquist = fs / 2
+    microbarom = 0.5 * np.sin(2 * np.pi * min(0.2, 0.4 * nyquist) * times + rng.uniform(0, 2 * np.pi))
+    drift = np.cumsum(rng.normal(0, 0.01, length))
+    noise = rng.normal(0, 0.2, length)
+    data = microbarom + drift + noise
+    if signal:
+        onset = int(rng.integers(0, max(1, length // 2)))
+        t = times[onset:] - times[onset]
+        data[onset:] += 3.0 * np.exp(-t / (50 / fs)) * np.sin(2 * np.pi * 0.6 * nyquist * t)
+    return times, data
+
+
+def write_supervise_data(supervise_data_fpath, threshold_variable_list, place_name_list, recordings, length, fs, seed=0):
+    """
+    Make supervise_data tree for run_mfcc.
+    supervise_data/threshold/supervise_label_0/place/*.csv is signal, supervise_label_1 is noise.
+    Lengths are length and its next prime number by turns.
+    """
+    rng = np.random.default_rng(seed)
+    lengths = [length, next_prime(length)]
+    for threshold_variable in threshold_variable_list:
+        for label_folder, signal in [("supervise_label_0", True), ("supervise_label_1", False)]:
+            for place_name in place_name_list:
+                place_fpath = supervise_data_fpath + "/" + threshold_variable + "/" + label_folder + "/" + place_name
+                os.makedirs(place_fpath, exist_ok=True)
+                for i in range(recordings):
+                    times, data = generate_infrasound(lengths[i % 2], fs, signal, int(rng.integers(0, 2 ** 31)))
+                    np.savetxt(place_fpath + "/" + "synthetic_" + str(i) + ".csv", np.column_stack([times, data]),
+                        delimiter=",", header="SensorTimeStamp,InfAC", comments="")
+    return 0
@@ -1,29 +1,26 @@
 #coding:utf-8
-import wave
+#数値計算の本体。起動を軽くするため numpy 以外は使う時に読み込む(グラフは plot モジュール)
+import threading
+import collections
 import numpy as np
-import scipy.signal
-import scipy.fftpack
-import scipy.fftpack.realtransforms
-import copy
-import sys
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import warnings
-warnings.filterwarnings('error')
 
 
 class MFCCclass():
     """
     This class is to make MFCC with signal. Output 12 dimention vector.
     """
-    def __init__(self, input_signal, fs, N, numChannels=20, cutpoint=12, fo=0.4, mel=1000, p_filter=0.97):
+    def __init__(self, input_signal, fs, N, numChannels=20, cutpoint=12, fo=0.4, mel=1000, p_filter=0.97, dtype=np.float64,
+                 padding=False, workers=1, highpass=False):
         """
         numChannels: number of filterbank
         fs: sampling rate
         input_signal:input signal data. type of list
         start: start input data
         N: number of samples, or window width
+        dtype: float64 or float32 for the whole calculation
+        padding: if True, zero pad to fast FFT length (next 5-smooth number) and make filterbank for it
+        workers: threads of FFT of large frame matrix (scipy.fft), -1 is all CPUs
+        highpass: if True, apply adaptive_highpass to amplitude spectrum before filterbank
         """
         self.input_signal= input_signal
         self.fs = fs
@@ -33,115 +30,60 @@ class MFCCclass():
         self.mel = mel
         self.cutpoint = cutpoint
         self.p_filter = p_filter
+        self.dtype = dtype
+        self.padding = padding
+        self.workers = workers
+        self.highpass = highpass
 
 
     def PreEmphasisFilter(self):
         """
         Make PreEmphasisFilter using hamming window. constant p_filter = 0.97.
         """
-        def get_preEmphasis(signals, p):
-            """
-            Make FIR[1.0, -9] filter.
-            """
-            return scipy.signal.lfilter([1.0,-p],1,signals)
-
         #p_filter: プレエンファシスフィルタ
-        return get_preEmphasis(self.input_signal, self.p_filter)  
+        return pre_emphasis(self.input_signal, self.p_filter, dtype=self.dtype)
+
+
+    def get_plan(self):
+        """
+        Get cached MFCCPlan with parameters of this object.
+        """
+        return get_plan(self.fs, self.N, self.numChannels, self.cutpoint, self.fo, self.mel, self.p_filter, self.dtype,
+                        self.padding, self.workers, self.highpass)
 
 
     def melFilterBank(self):
         """
-        Get mel filter bank.
-        """
-        mo = self.mel / np.log((self.mel / self.fo) + 1)
-        
-        def Hz2mel(f):
-            """
-            transform Hz to mel.
-            """
-            return mo * np.log(f / self.fo + 1.0)
-        
-
-        def mel2hz(m):
-            """
-            transform mel to Hz
-            """
-            return self.fo * (np.exp(m / mo) - 1.0)
-
-        fmax = self.fs / 2 #ナイキスト周波数
-        melmax = Hz2mel(fmax) #ナイキスト周波数(mel)
-        nmax = int(self.N / 2) #周波数インデックスの最大数
-        df = self.fs / self.N #周波数解像度
-
-        #メル尺度における各フィルタの中心周波数を求める
-        #dmel = melmax / (self.numChannels + 1)
-        dmel = melmax / (self.numChannels+1)
-        melcenters = np.arange(1, self.numChannels + 1) * dmel
-        #各フィルタの中心周波数をHzに変換
-        fcenters = mel2hz(melcenters)
-
-        #各フィルタの中心周波数を周波数インデックスに変換
-        indexcenter = np.round(fcenters / df)
-        
-        #各フィルタの開始位置のインデックス
-        indexstart = np.hstack(([0], indexcenter[0:self.numChannels - 1]))
-
-        # 各フィルタの終了位置のインデックス
-        indexstop = np.hstack((indexcenter[1:self.numChannels], [nmax]))
-
-        filterbank = np.zeros((self.numChannels, nmax))
-        for c in np.arange(0,self.numChannels):
-            #三角フィルタの左の直線の傾きから点を求める
-            increment = 1.0 / (indexcenter[c] - indexstart[c])
-            for i in np.arange(indexstart[c], indexcenter[c]):
-                filterbank[int(c), int(i)] = (i - indexstart[c]) * increment
-            #三角フィルタの右の直線の傾きから点を求める
-            decrement = 1.0 / (indexstop[c] - indexcenter[c])
-            for i in np.arange(indexcenter[c], indexstop[c]):
-                filterbank[int(c),int(i)] = 1.0 - ((i - indexcenter[c]) * decrement)
-        
-        return filterbank, fcenters
+        Get dense mel filter bank (numChannels x N/2) from sparse filter bank of MFCCPlan.
+        """
+        plan = self.get_plan()
+        return plan.filterbank, plan.fcenters
 
 
     def find_cutpoint(self, freq_seq, nq_fft_list):
         """
         Find Cutpoint for highpass-filter.
+        Thresholds of all steps are calculated at once with cutpoint_thresholds. nq_fft_list is not changed.
         """
-        magnitude = 1
-        count = 0
-        min_freq = 0
-        min_array_number = 0
-
-        threshold_list = []
-        for i in range(len(nq_fft_list)):
-            mean_fft_amp = np.mean(nq_fft_list)
-            var_fft_amp = np.std(nq_fft_list)
-            threshold = mean_fft_amp + magnitude * var_fft_amp
-            analysis_freq = nq_fft_list[i]
-            if analysis_freq >= threshold:
-                nq_fft_list[i] = 0
-                count += 1
-            else:
-                min_freq = freq_seq[i + 1]
-                min_array_number = count + 1
-                #print("min frequency = {}".format(min_freq))
-                break    
-            threshold_list.append(threshold)
-        return min_freq, min_array_number, threshold_list
+        nq_fft_list = np.asarray(nq_fft_list, dtype=float)[np.newaxis, :]
+        thresholds = cutpoint_thresholds(nq_fft_list)[0]
+        min_array_number = int(adaptive_cutpoint(nq_fft_list)[0])
+        if min_array_number == 0:
+            #全ての点が閾値以上
+            return 0, 0, list(thresholds)
+        min_freq = freq_seq[min_array_number]
+        return min_freq, min_array_number, list(thresholds[:min_array_number - 1])
 
 
-    def highpassfilter(self, freq_seq, fft_data, dF):
+    def highpassfilter(self, freq_seq, fft_data, dF, cut_number=None):
         """
-        Highpass Filter
+        Highpass Filter. Cutoff is dF * cut_number (min_array_number of find_cutpoint), or dF * cutpoint if it is None.
         """
-        fc = dF * self.cutpoint
-        fft_highpass = copy.copy(fft_data)
+        fc = dF * (self.cutpoint if cut_number is None else cut_number)
+        fft_highpass = np.copy(fft_data)
 
-        count = 0
-        for freq in freq_seq:
-            if freq - fc >=0:
-                break
-            count += 1
+        #fc 未満の周波数の数
+        count = int(np.searchsorted(freq_seq, fc, side='left'))
         fft_highpass[:count] = 0
         fft_highpass[len(fft_highpass) - count:] = 0
         return fft_highpass
@@ -152,37 +94,9 @@ class MFCCclass():
         Get MFCC from transfroming spectrum.
         Cutpoint have a role cutting mel filter bank. Defalut is 12.
         """
-        def get_mean(array):
-            return sum(array) / len(array)
-
-        def assign_mean_to_zero(array):
-            """
-            If antilogarithm is 0, assign mean with other data
-            """
-            zero_array_numbers = [i for i in range(len(array)) if array[i] == 0]
-            not_zero_array_numbers = [i for i in range(len(array)) if array[i] != 0]
-            mean = get_mean(not_zero_array_numbers)
-            for i in zero_array_numbers:
-                array[i] = mean
-            return array
-
-
-        dF = self.fs / self.N
-        PEf_Data = self.PreEmphasisFilter()
-        windowedData = np.hamming(self.N) * PEf_Data
-        fft_data = abs(np.fft.fft(windowedData))[:int(self.N/2)]
-        #higpass-filter        
-        #freq_seq = np.arange(0, self.fs, dF)
-        #nq_fft_list = abs(fft_data)[:int(self.N / 2)]
-        #min_freq, min_array_number, threshold_list = self.find_cutpoint(freq_seq, nq_fft_list)
-        #fft_highpass = self.highpassfilter(freq_seq, fft_data, dF, min_array_number)
-
-        filterbank, fcenters = self.melFilterBank() #フィルタバンクを求める
-        inner_product_fbank = np.dot(fft_data, filterbank.T)
-        modify_dot = assign_mean_to_zero(inner_product_fbank)
-        mspec = np.log10(modify_dot) #スペクトル領域にフィルタバンクをかける
-        ceps = scipy.fftpack.realtransforms.dct(mspec,type=2,norm="ortho",axis=-1) #離散コサイン変換
-        return ceps[1:self.cutpoint+1]
+        frames = np.asarray(self.input_signal, dtype=self.dtype)[np.newaxis, :]
+        ceps = self.get_plan().mfcc(frames)
+        return ceps[0]
 
 
     def get_melfilterbank(self, fname):
@@ -190,34 +104,977 @@ class MFCCclass():
         Generate Mel-filterbank graph.
         """
         #メルフィルタバンク
-        import matplotlib
-        matplotlib.use('Agg')
-        import matplotlib.pyplot as plt
-        plt.clf()
-        filterbank, fcenters = self.melFilterBank()
-        #周波数解像度
-        df = self.fs / self.N
-        for i in np.arange(0, self.numChannels):
-            #plt.plot(np.arange(0, self.N)* df, filterbank[i])
-            plt.plot(np.arange(0,len(filterbank[i]))*df, filterbank[i])
-        plt.xlim(0, self.fs / 2)
-        plt.ylim(0, 1.0)
-        plt.xlabel("frequency")
-        plt.savefig(fname + '_melfilterbank.png')
+        from . import plot
+        filterbank, fcenters = self.melFilterBank() #キャッシュされたプランのフィルタバンクを密行列にしたもの
+        return plot.plot_melfilterbank(filterbank, self.fs, self.get_plan().fft_size, fname)
+
+
+    def sweep(self, configs):
+        """
+        Get MFCC for each (numChannels, cutpoint, fo, mel) in configs. Amplitude spectrum is calculated once.
+        Return list of MFCC, None where zero division occurred.
+        """
+        frames = np.asarray(self.input_signal, dtype=self.dtype)[np.newaxis, :]
+        fft_data = amplitude_spectrum(frames, self.p_filter, self.dtype, self.padding, self.workers, self.highpass)
+        plan = get_sweep_plan(self.fs, self.N, configs, self.dtype, self.padding)
+        ceps, zero_division = plan.cepstrum(fft_data)
+        return [None if zero_division[c] else ceps[c, 0, :plan.ncoeffs[c]] for c in range(len(plan.configs))]
+
+
+HIGHPASS_MAGNITUDE = 1 #適応ハイパスの閾値 mean + HIGHPASS_MAGNITUDE * std
+
+
+def cutpoint_thresholds(fft_data, magnitude=HIGHPASS_MAGNITUDE):
+    """
+    Get threshold mean + magnitude * std of each step of MFCCclass.find_cutpoint for each frame (... x bins).
+    At step i, bins before i are already 0, so mean and std are taken from suffix sums in O(bins).
+    """
+    fft_data = np.asarray(fft_data, dtype=np.float64)
+    nbins = fft_data.shape[-1]
+    #0にした点は和に入らないので、i 以降の和と二乗和をそのまま使う
+    suffix_sum = np.cumsum(fft_data[..., ::-1], axis=-1)[..., ::-1]
+    suffix_square_sum = np.cumsum((fft_data ** 2)[..., ::-1], axis=-1)[..., ::-1]
+    mean = suffix_sum / nbins
+    var = np.maximum(suffix_square_sum / nbins - mean ** 2, 0.0)
+    return mean + magnitude * np.sqrt(var)
+
+
+def adaptive_cutpoint(fft_data, magnitude=HIGHPASS_MAGNITUDE):
+    """
+    Get min_array_number of MFCCclass.find_cutpoint for each frame (... x bins).
+    Bins are removed from the lowest while they are over the threshold, and the first bin under it is also removed.
+    0 if all bins are over the threshold.
+    """
+    fft_data = np.asarray(fft_data)
+    if fft_data.shape[-1] == 0:
+        return np.zeros(fft_data.shape[:-1], dtype=np.intp)
+    over = fft_data >= cutpoint_thresholds(fft_data, magnitude)
+    first_under = np.argmin(over, axis=-1)
+    return np.where(over.all(axis=-1), 0, first_under + 1)
+
+
+def adaptive_highpass(fft_data, magnitude=HIGHPASS_MAGNITUDE):
+    """
+    Adaptive high-pass filter of amplitude spectrum (... x bins) to suppress microbarom and low frequency drift.
+    Bins lower than the cutoff of find_cutpoint are set to 0 in each frame. Return new array.
+    """
+    fft_data = np.asarray(fft_data)
+    cut = adaptive_cutpoint(fft_data, magnitude)
+    return np.where(np.arange(fft_data.shape[-1]) < cut[..., np.newaxis], 0, fft_data).astype(fft_data.dtype, copy=False)
+
+
+def float_dtype(dtype):
+    """
+    Check calculation dtype. Only float64 and float32 are supported.
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float64, np.float32):
+        raise ValueError("dtype have to be float64 or float32.")
+    return dtype
+
+
+def next_fast_length(N):
+    """
+    Get the smallest 5-smooth number (2^a 3^b 5^c) not less than N. FFT of this length is fast.
+    """
+    if N <= 2:
+        return N
+    best = 1 << (N - 1).bit_length() #N以上の最小の2のべき乗
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            quotient = -(-N // power35)
+            best = min(best, (1 << (quotient - 1).bit_length()) * power35)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+def fft_length(N, padding=False):
+    """
+    Get FFT length of frames of length N. It is N, or next_fast_length(N) with padding.
+    """
+    return next_fast_length(N) if padding else N
+
+
+def pre_emphasis(signals, p_filter, zi=None, dtype=np.float64):
+    """
+    FIR[1.0, -p_filter] filter along last axis, the same as scipy.signal.lfilter([1.0, -p_filter], 1, signals).
+    zi is the sample before signals. Pass the last sample of previous chunk to continue filtering.
+    """
+    signals = np.asarray(signals, dtype=dtype)
+    emphasized = signals.copy()
+    emphasized[..., 1:] -= p_filter * signals[..., :-1]
+    if zi is not None and emphasized.shape[-1] > 0:
+        emphasized[..., 0] -= p_filter * zi
+    return emphasized
+
+
+def mel_bands(fs, N, numChannels=20, fo=0.4, mel=1000):
+    """
+    Get frequency index band of each triangle of mel filter bank.
+    Return indexstart, indexcenter, indexstop, increment and decrement (slopes) of each channel, and center frequencies.
+    """
+    mo = mel / np.log((mel / fo) + 1)
+
+    def Hz2mel(f):
+        """
+        transform Hz to mel.
+        """
+        return mo * np.log(f / fo + 1.0)
+
+
+    def mel2hz(m):
+        """
+        transform mel to Hz
+        """
+        return fo * (np.exp(m / mo) - 1.0)
+
+    fmax = fs / 2 #ナイキスト周波数
+    melmax = Hz2mel(fmax) #ナイキスト周波数(mel)
+    nmax = int(N / 2) #周波数インデックスの最大数
+    df = fs / N #周波数解像度
+
+    #メル尺度における各フィルタの中心周波数を求める
+    dmel = melmax / (numChannels + 1)
+    melcenters = np.arange(1, numChannels + 1) * dmel
+    #各フィルタの中心周波数をHzに変換
+    fcenters = mel2hz(melcenters)
+
+    #各フィルタの中心周波数を周波数インデックスに変換
+    indexcenter = np.round(fcenters / df)
+
+    #各フィルタの開始位置のインデックス
+    indexstart = np.hstack(([0], indexcenter[0:numChannels - 1]))
+
+    # 各フィルタの終了位置のインデックス
+    indexstop = np.hstack((indexcenter[1:numChannels], [nmax]))
+
+    #幅が0のフィルタは点を持たないので傾きは0にしておく
+    left_width = indexcenter - indexstart
+    right_width = indexstop - indexcenter
+    increment = np.divide(1.0, left_width, out=np.zeros(numChannels), where=left_width > 0)
+    decrement = np.divide(1.0, right_width, out=np.zeros(numChannels), where=right_width > 0)
+    return indexstart, indexcenter, indexstop, increment, decrement, fcenters
+
+
+def mel_filterbank(fs, N, numChannels=20, fo=0.4, mel=1000):
+    """
+    Get dense mel filter bank (numChannels x N/2) and center frequencies.
+    Triangles are filled with one broadcast instead of the loop over each frequency index.
+    """
+    indexstart, indexcenter, indexstop, increment, decrement, fcenters = mel_bands(fs, N, numChannels, fo, mel)
+    index = np.arange(int(N / 2))[np.newaxis, :]
+    indexstart = indexstart[:, np.newaxis]
+    indexcenter = indexcenter[:, np.newaxis]
+    indexstop = indexstop[:, np.newaxis]
+    #三角フィルタの左の直線の傾きから点を求める
+    left = (index - indexstart) * increment[:, np.newaxis]
+    #三角フィルタの右の直線の傾きから点を求める
+    right = 1.0 - ((index - indexcenter) * decrement[:, np.newaxis])
+    filterbank = np.where((index >= indexstart) & (index < indexcenter), left, 0.0)
+    filterbank = np.where((index >= indexcenter) & (index < indexstop), right, filterbank)
+    return filterbank, fcenters
+
+
+def sparse_mel_filterbank(fs, N, numChannels=20, fo=0.4, mel=1000, dtype=np.float64):
+    """
+    Get SparseFilterbank of mel filter bank and center frequencies.
+    Weights are the same values as mel_filterbank in each band [indexstart, indexstop).
+    """
+    indexstart, indexcenter, indexstop, increment, decrement, fcenters = mel_bands(fs, N, numChannels, fo, mel)
+    indexstart = indexstart.astype(np.intp)
+    indexstop = indexstop.astype(np.intp)
+    lengths = indexstop - indexstart
+    channel = np.repeat(np.arange(numChannels), lengths)
+    index = np.repeat(indexstart - np.cumsum(lengths) + lengths, lengths) + np.arange(np.sum(lengths))
+    #三角フィルタの左右の直線
+    left = (index - indexstart[channel]) * increment[channel]
+    right = 1.0 - ((index - indexcenter[channel]) * decrement[channel])
+    weights = np.where(index < indexcenter[channel], left, right)
+    return SparseFilterbank(indexstart, indexstop, weights.astype(dtype), int(N / 2)), fcenters
+
+
+DENSE_FILTERBANK_SIZE = 1 << 16 #この要素数以下のフィルタバンクは密行列の積の方が速い
+
+
+class SparseFilterbank():
+    """
+    Filter bank keeping each channel only over its band [indexstart, indexstop).
+    Channels are split into layers of bands not overlapping each other (2 layers for mel filter bank),
+    and channel energy is a segment sum of each layer. Memory and calculation are proportional to
+    number of layers x nbins, not channels x nbins.
+    Small filter bank (channels x nbins <= DENSE_FILTERBANK_SIZE) also keeps dense matrix for BLAS.
+    """
+    def __init__(self, indexstart, indexstop, weights, nbins):
+        self.indexstart = np.asarray(indexstart, dtype=np.intp)
+        self.indexstop = np.asarray(indexstop, dtype=np.intp)
+        self.weights = np.asarray(weights)
+        self.nbins = nbins
+        lengths = self.indexstop - self.indexstart
+        if np.sum(lengths) != len(self.weights):
+            raise ValueError("weights have to be the total length of bands.")
+        self.offsets = np.cumsum(lengths) - lengths #各チャネルの重みの開始位置
+
+        #帯域が重ならないチャネルを同じ層に入れる。幅0のチャネルはどの層にも入れない
+        layers = []
+        for channel in np.argsort(self.indexstart, kind='stable'):
+            if lengths[channel] == 0:
+                continue
+            for layer in layers:
+                if self.indexstop[layer[-1]] <= self.indexstart[channel]:
+                    layer.append(channel)
+                    break
+            else:
+                layers.append([channel])
+        self.layer_channels = [np.array(layer, dtype=np.intp) for layer in layers]
+        self.layer_weights = np.zeros((len(layers), nbins), dtype=self.weights.dtype)
+        for l, layer in enumerate(layers):
+            for channel in layer:
+                self.layer_weights[l, self.indexstart[channel]:self.indexstop[channel]] = \
+                    self.weights[self.offsets[channel]:self.offsets[channel] + lengths[channel]]
+        self.dense = self.toarray() if len(self) * nbins <= DENSE_FILTERBANK_SIZE else None
+        for array in (self.indexstart, self.indexstop, self.weights, self.offsets, self.layer_weights):
+            array.flags.writeable = False
+
+
+    def __len__(self):
+        return len(self.indexstart)
+
+
+    def energy(self, fft_data):
+        """
+        Get channel energy (... x channels) from amplitude spectrum (... x nbins), the same as np.dot(fft_data, dense.T).
+        """
+        fft_data = np.asarray(fft_data)
+        if self.dense is not None:
+            return np.dot(fft_data, self.dense.T)
+        energy = np.zeros(fft_data.shape[:-1] + (len(self),), dtype=np.result_type(fft_data, self.weights))
+        for channels, layer_weights in zip(self.layer_channels, self.layer_weights):
+            #層の中の区間 [indexstart, 次のindexstart) の和。帯域外の重みは0
+            energy[..., channels] = np.add.reduceat(fft_data * layer_weights, self.indexstart[channels], axis=-1)
+        return energy
+
+
+    def toarray(self):
+        """
+        Get dense filter bank (channels x nbins).
+        """
+        dense = np.zeros((len(self), self.nbins), dtype=self.weights.dtype)
+        lengths = self.indexstop - self.indexstart
+        channel = np.repeat(np.arange(len(self)), lengths)
+        index = np.repeat(self.indexstart - self.offsets, lengths) + np.arange(len(self.weights))
+        dense[channel, index] = self.weights
+        return dense
+
+
+def stack_filterbanks(filterbanks):
+    """
+    Concatenate channels of SparseFilterbanks with the same nbins into one SparseFilterbank.
+    """
+    return SparseFilterbank(np.concatenate([filterbank.indexstart for filterbank in filterbanks]),
+        np.concatenate([filterbank.indexstop for filterbank in filterbanks]),
+        np.concatenate([filterbank.weights for filterbank in filterbanks]), filterbanks[0].nbins)
+
+
+def dct_matrix(numChannels):
+    """
+    Get orthonormal DCT-II matrix (numChannels x numChannels).
+    np.dot(mspec, dct_matrix(numChannels).T) is dct(mspec, type=2, norm="ortho").
+    """
+    k = np.arange(numChannels)[:, np.newaxis]
+    n = np.arange(numChannels)[np.newaxis, :]
+    basis = np.cos(np.pi * k * (2 * n + 1) / (2 * numChannels))
+    scale = np.full((numChannels, 1), np.sqrt(2.0 / numChannels))
+    scale[0] = np.sqrt(1.0 / numChannels)
+    return scale * basis
+
+
+PARALLEL_FFT_SIZE = 1 << 18 #この要素数以上のフレーム行列は workers のスレッドで FFT する
+
+
+class SpectrumPlan():
+    """
+    Precomputed setup of amplitude spectrum for frame length N.
+    The spectrum does not depend on filter bank parameters, so MFCCPlans of the same N share it.
+    Real input FFT of fft_size = fft_length(N, padding) gives fft_size/2 bins. With padding, windowed frames are zero padded.
+    Frame matrix of PARALLEL_FFT_SIZE samples or more is transformed with scipy.fft in workers threads if workers is not 1.
+    pocketfft splits threads over rows, so one row (whole-record MFCC) is always transformed with numpy in one thread.
+    With highpass, adaptive_highpass is applied to the spectrum of each frame.
+    """
+    def __init__(self, N, p_filter=0.97, dtype=np.float64, padding=False, workers=1, highpass=False):
+        self.N = N
+        self.p_filter = p_filter
+        self.dtype = float_dtype(dtype)
+        self.padding = padding
+        self.workers = workers
+        self.highpass = highpass
+        self.fft_size = fft_length(N, padding)
+        self.nbins = int(self.fft_size / 2)
+        self.window = np.hamming(N).astype(self.dtype)
+        self.window.flags.writeable = False
+
+
+    def pre_emphasis(self, frames):
+        """
+        Apply pre-emphasis filter to each frame independently.
+        """
+        return pre_emphasis(frames, self.p_filter, dtype=self.dtype)
+
+
+    def windowing(self, emphasized_frames):
+        """
+        Multiply hamming window to each frame.
+        """
+        return self.window * emphasized_frames
+
+
+    def fft(self, windowed_frames):
+        """
+        Get amplitude spectrum (number of frames x fft_size/2) from windowed frames.
+        """
+        windowed_frames = np.asarray(windowed_frames)
+        spectrum = None
+        if self.workers != 1 and windowed_frames.size >= PARALLEL_FFT_SIZE and windowed_frames.shape[0] > 1:
+            try:
+                from scipy import fft as scipy_fft
+            except ImportError:
+                scipy_fft = None
+            if scipy_fft is not None:
+                #pocketfft のスレッドはフレームごとに分かれる
+                spectrum = scipy_fft.rfft(windowed_frames, n=self.fft_size, axis=-1, workers=self.workers)
+        if spectrum is None:
+            spectrum = np.fft.rfft(windowed_frames, n=self.fft_size, axis=-1)
+        #numpy 2 は float32 を complex64 のまま変換する。古い numpy では complex128 になるので戻す
+        return np.abs(spectrum[:, :self.nbins]).astype(self.dtype, copy=False)
+
+
+    def spectrum(self, emphasized_frames):
+        """
+        Get amplitude spectrum (number of frames x fft_size/2) from pre-emphasized frames.
+        """
+        return self.transform(self.windowing(emphasized_frames))
+
+
+    def transform(self, windowed_frames):
+        """
+        Get amplitude spectrum (number of frames x fft_size/2) from windowed frames, with adaptive high-pass if highpass.
+        """
+        fft_data = self.fft(windowed_frames)
+        if self.highpass:
+            fft_data = adaptive_highpass(fft_data)
+        return fft_data
+
+
+    def amplitude_spectrum(self, frames):
+        """
+        Get amplitude spectrum (number of frames x fft_size/2) from frame matrix (number of frames x N).
+        """
+        frames = np.asarray(frames, dtype=self.dtype)
+        return self.spectrum(self.pre_emphasis(frames))
+
+
+class MFCCPlan():
+    """
+    Precomputed MFCC setup for one parameter set, like a FFTW plan.
+    Hamming window, mel filter bank and DCT-II basis are made once and shared read-only.
+    Get plans with get_plan so that same frame length shares one plan.
+    """
+    def __init__(self, fs, N, numChannels=20, cutpoint=12, fo=0.4, mel=1000, p_filter=0.97, dtype=np.float64,
+                 padding=False, workers=1, highpass=False):
+        self.fs = fs
+        self.N = N
+        self.numChannels = numChannels
+        self.cutpoint = cutpoint
+        self.fo = fo
+        self.mel = mel
+        self.p_filter = p_filter
+
+        self.spectrum_plan = get_spectrum_plan(N, p_filter, dtype, padding, workers, highpass)
+        self.dtype = self.spectrum_plan.dtype
+        self.fft_size = self.spectrum_plan.fft_size
+        self.window = self.spectrum_plan.window
+        #フィルタバンクは FFT の長さで作る
+        self.sparse_filterbank, self.fcenters = sparse_mel_filterbank(fs, self.fft_size, numChannels, fo, mel, self.dtype)
+        #0次の係数は使わないので1からcutpointまでの基底だけ持つ
+        self.dct_basis = dct_matrix(numChannels)[1:cutpoint+1].astype(self.dtype)
+        for array in (self.fcenters, self.dct_basis):
+            array.flags.writeable = False
+
+
+    def pre_emphasis(self, frames):
+        return self.spectrum_plan.pre_emphasis(frames)
+
+
+    def windowing(self, emphasized_frames):
+        return self.spectrum_plan.windowing(emphasized_frames)
+
+
+    def fft(self, windowed_frames):
+        return self.spectrum_plan.fft(windowed_frames)
+
+
+    def spectrum(self, emphasized_frames):
+        return self.spectrum_plan.spectrum(emphasized_frames)
+
+
+    @property
+    def filterbank(self):
+        """
+        Dense mel filter bank (numChannels x fft_size/2). It is made on each access, so use it only for plot.
+        """
+        return self.sparse_filterbank.toarray()
+
+
+    def filterbank_energy(self, fft_data):
+        """
+        Get log mel spectrum (number of frames x numChannels) from amplitude spectrum.
+        """
+        inner_product_fbank = self.sparse_filterbank.energy(fft_data)
+        modify_dot = assign_mean_to_zero(inner_product_fbank)
+        return np.log10(modify_dot) #スペクトル領域にフィルタバンクをかける
+
+
+    def dct(self, mspec):
+        """
+        Get MFCC matrix (number of frames x cutpoint) from log mel spectrum.
+        """
+        return np.dot(mspec, self.dct_basis.T) #離散コサイン変換
+
+
+    def cepstrum(self, fft_data):
+        """
+        Get MFCC matrix (number of frames x cutpoint) from amplitude spectrum.
+        """
+        return self.dct(self.filterbank_energy(fft_data))
+
+
+    def masked_cepstrum(self, fft_data):
+        """
+        Get MFCC matrix (number of frames x cutpoint) from amplitude spectrum like cepstrum,
+        but a row with all filterbank outputs zero does not raise ZeroDivisionError.
+        Return MFCC matrix and zero division flag of each row. MFCC of flagged rows is 0.
+        """
+        energy = self.sparse_filterbank.energy(fft_data)
+        zero_division = np.zeros(energy.shape[:-1], dtype=bool)
+        if not energy.all():
+            zero_division = ~energy.any(axis=-1)
+            energy[zero_division] = 1 #log10(1) = 0
+        return self.dct(np.log10(assign_mean_to_zero(energy))), zero_division
+
+
+    def mfcc(self, frames):
+        """
+        Get MFCC matrix (number of frames x cutpoint) from frame matrix (number of frames x N).
+        """
+        frames = np.asarray(frames, dtype=self.dtype)
+        return self.cepstrum(self.spectrum(self.pre_emphasis(frames)))
+
+
+class SweepPlan():
+    """
+    Precomputed MFCC setup for a grid of (numChannels, cutpoint, fo, mel) with one frame length.
+    Channels of all filter banks are concatenated into one sparse filter bank, and channel energy is scattered to
+    filter banks zero padded to the largest numChannels. DCT bases are zero padded to the largest cutpoint and stacked,
+    so all configurations are calculated from one amplitude spectrum with one segment sum and one batched matmul.
+    Configurations with the same (numChannels, fo, mel) share one filter bank.
+    """
+    def __init__(self, fs, N, configs, dtype=np.float64, padding=False):
+        self.fs = fs
+        self.N = N
+        self.dtype = float_dtype(dtype)
+        self.fft_size = fft_length(N, padding)
+        self.configs = tuple(tuple(config) for config in configs)
+        if len(self.configs) == 0:
+            raise ValueError("configs is empty")
+
+        banks = []
+        self.bank_index = np.zeros(len(self.configs), dtype=np.intp)
+        for c, (numChannels, cutpoint, fo, mel) in enumerate(self.configs):
+            if (numChannels, fo, mel) not in banks:
+                banks.append((numChannels, fo, mel))
+            self.bank_index[c] = banks.index((numChannels, fo, mel))
+        max_channels = max(numChannels for numChannels, fo, mel in banks)
+
+        #全フィルタバンクのチャネルを1つの疎なフィルタバンクにつなげ、チャネル数の最大値まで0で埋めた位置に戻す
+        self.filterbank = stack_filterbanks([sparse_mel_filterbank(fs, self.fft_size, numChannels, fo, mel, self.dtype)[0]
+            for numChannels, fo, mel in banks])
+        self.channel_mask = np.zeros((len(banks), max_channels), dtype=bool)
+        for b, (numChannels, fo, mel) in enumerate(banks):
+            self.channel_mask[b, :numChannels] = True
+
+        #DCT基底も同様に係数の数とチャネル数の最大値まで0で埋める
+        bases = [dct_matrix(numChannels)[1:cutpoint+1] for numChannels, cutpoint, fo, mel in self.configs]
+        self.ncoeffs = np.array([len(basis) for basis in bases], dtype=np.intp)
+        self.dct_basis = np.zeros((len(self.configs), max(self.ncoeffs), max_channels), dtype=self.dtype)
+        for c, basis in enumerate(bases):
+            self.dct_basis[c, :basis.shape[0], :basis.shape[1]] = basis
+        for array in (self.bank_index, self.channel_mask, self.ncoeffs, self.dct_basis):
+            array.flags.writeable = False
+
+
+    def filterbank_energy(self, fft_data):
+        """
+        Get log mel spectrum (filter banks x number of frames x max numChannels) from amplitude spectrum.
+        Zero is replaced as assign_mean_to_zero in each filter bank. Padded channels are 0.
+        Return log mel spectrum and zero division flag of each filter bank.
+        """
+        fft_data = np.asarray(fft_data, dtype=self.dtype)
+        energy = np.zeros((self.channel_mask.shape[0], fft_data.shape[0], self.channel_mask.shape[1]), dtype=self.dtype)
+        energy.transpose(1, 0, 2)[:, self.channel_mask] = self.filterbank.energy(fft_data)
+        mask = self.channel_mask[:, np.newaxis, :]
+        is_zero = (energy == 0) & mask
+        not_zero = mask & ~is_zero
+        not_zero_count = np.count_nonzero(not_zero, axis=-1)
+        zero_division = (not_zero_count == 0).any(axis=-1)
+        array_numbers = np.arange(energy.shape[-1])
+        mean = (np.sum(array_numbers * not_zero, axis=-1) / np.maximum(not_zero_count, 1)).astype(self.dtype)
+        energy = np.where(is_zero, mean[..., np.newaxis], energy)
+        #パディングしたチャネルと0除算になったフィルタバンクは log10(1) = 0 にする
+        energy = np.where(mask & ~zero_division[:, np.newaxis, np.newaxis], energy, 1.0)
+        return np.log10(energy), zero_division
+
+
+    def cepstrum(self, fft_data):
+        """
+        Get MFCC tensor (configs x number of frames x max cutpoint) from amplitude spectrum.
+        MFCC of configs[c] is [c, :, :ncoeffs[c]].
+        Return MFCC tensor and zero division flag of each configuration.
+        """
+        mspec, zero_division = self.filterbank_energy(fft_data)
+        ceps = np.matmul(mspec[self.bank_index], self.dct_basis.transpose(0, 2, 1)) #離散コサイン変換
+        return ceps, zero_division[self.bank_index]
+
+
+PLAN_CACHE_SIZE = 16 #保持するプランの最大数
+PLAN_CACHE_BYTES = 64 << 20 #保持するプランの配列の合計の上限。これより大きいプランは保持しない
+
+
+def plan_nbytes(plan, seen=None):
+    """
+    Get bytes of numpy arrays held by plan, its spectrum plan and its filter bank. Shared arrays are counted once.
+    """
+    if seen is None:
+        seen = set()
+    nbytes = 0
+    for attribute in vars(plan).values():
+        values = attribute if isinstance(attribute, list) else [attribute]
+        for value in values:
+            if id(value) in seen:
+                continue
+            seen.add(id(value))
+            if isinstance(value, np.ndarray):
+                nbytes += value.nbytes
+            elif isinstance(value, (SpectrumPlan, SparseFilterbank)):
+                nbytes += plan_nbytes(value, seen)
+    return nbytes
+
+
+class PlanCache():
+    """
+    LRU cache of plans bounded by number of plans (max_size) and bytes of their arrays (max_bytes).
+    Whole-record plans have N = len(data) and are rarely reused, so a plan over max_bytes is made on each call and not kept.
+    """
+    def __init__(self, make_plan, max_size=PLAN_CACHE_SIZE, max_bytes=PLAN_CACHE_BYTES):
+        self.make_plan = make_plan
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.plans = collections.OrderedDict() #引数 -> (プラン, バイト数)
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+
+    def get(self, *args):
+        with self.lock:
+            if args in self.plans:
+                self.plans.move_to_end(args)
+                return self.plans[args][0]
+        plan = self.make_plan(*args)
+        nbytes = plan_nbytes(plan)
+        if nbytes > self.max_bytes:
+            return plan
+        with self.lock:
+            if args not in self.plans:
+                self.plans[args] = (plan, nbytes)
+                self.nbytes += nbytes
+            while len(self.plans) > self.max_size or self.nbytes > self.max_bytes:
+                old_plan, old_nbytes = self.plans.popitem(last=False)[1]
+                self.nbytes -= old_nbytes
+        return plan
+
+
+    def clear(self):
+        with self.lock:
+            self.plans.clear()
+            self.nbytes = 0
         return 0
 
 
+_spectrum_plans = PlanCache(SpectrumPlan)
+_plans = PlanCache(MFCCPlan)
+_sweep_plans = PlanCache(SweepPlan)
+
+
+def get_spectrum_plan(N, p_filter=0.97, dtype=np.float64, padding=False, workers=1, highpass=False):
+    """
+    Get SpectrumPlan from plan cache.
+    """
+    return _spectrum_plans.get(N, p_filter, np.dtype(dtype), padding, workers, highpass)
+
+
+def get_plan(fs, N, numChannels=20, cutpoint=12, fo=0.4, mel=1000, p_filter=0.97, dtype=np.float64, padding=False, workers=1,
+             highpass=False):
+    """
+    Get MFCCPlan from plan cache. Least recently used plan is dropped over PLAN_CACHE_SIZE plans or PLAN_CACHE_BYTES.
+    """
+    return _plans.get(fs, N, numChannels, cutpoint, fo, mel, p_filter, np.dtype(dtype), padding, workers, highpass)
+
+
+def get_sweep_plan(fs, N, configs, dtype=np.float64, padding=False):
+    """
+    Get SweepPlan of configs [(numChannels, cutpoint, fo, mel), ...] from plan cache.
+    """
+    return _sweep_plans.get(fs, N, tuple(tuple(config) for config in configs), np.dtype(dtype), padding)
+
+
+def assign_mean_to_zero(matrix):
+    """
+    If antilogarithm is 0, assign mean with other data in each row.
+    The mean is taken over the array numbers of not zero data, as MFCCclass always did.
+    Raise ZeroDivisionError if a row is all zero.
+    """
+    is_zero = (matrix == 0)
+    if not is_zero.any():
+        return matrix
+    not_zero_count = np.count_nonzero(~is_zero, axis=-1)
+    if (not_zero_count == 0).any():
+        raise ZeroDivisionError("all filterbank outputs are zero")
+    array_numbers = np.arange(matrix.shape[-1])
+    mean = (np.sum(array_numbers * ~is_zero, axis=-1) / not_zero_count).astype(matrix.dtype)
+    return np.where(is_zero, mean[:, np.newaxis], matrix)
+
+
+def batch_mfcc(frames, fs, numChannels=20, cutpoint=12, fo=0.4, mel=1000, p_filter=0.97, dtype=np.float64, padding=False, workers=1,
+               highpass=False):
+    """
+    Get MFCC matrix from frame matrix.
+    frames: 2-D array (number of frames x N). Each row is transformed the same as MFCCclass.mfcc().
+    Output (number of frames x cutpoint) matrix.
+    """
+    frames = np.asarray(frames, dtype=dtype)
+    plan = get_plan(fs, frames.shape[1], numChannels, cutpoint, fo, mel, p_filter, dtype, padding, workers, highpass)
+    return plan.mfcc(frames)
+
+
+def frame_starts(N, nframe, ov):
+    """
+    Get start numbers of each frame for signal length N.
+    Window shift is nframe * (1 - ov). Frames have to end before the last shift position.
+    """
+    shift = nframe * (1 - ov)
+    if shift <= 0:
+        raise ValueError("overlap rate have to set 0 <= ov < 1.")
+    shift_count = np.arange(int(N // shift) + 2)
+    start_window = (shift * shift_count[shift * shift_count <= N]).astype(int)
+    return start_window[start_window + nframe <= start_window[-1]]
+
+
+def frame_signal(data, nframe, ov, dtype=np.float64):
+    """
+    Get read-only frame matrix (number of frames x nframe) from signal.
+    If the shift is integer, the matrix is a strided view of data and no sample is copied.
+    Otherwise the frames are gathered into one new matrix.
+    """
+    data = np.asarray(data, dtype=dtype)
+    starts = frame_starts(len(data), nframe, ov)
+    shift = nframe * (1 - ov)
+    if float(shift).is_integer():
+        #開始位置が等間隔なのでストライドだけでフレームを表現できる
+        offset = starts[0] if len(starts) > 0 else 0
+        return np.lib.stride_tricks.as_strided(data[offset:], shape=(len(starts), nframe),
+            strides=(int(shift) * data.strides[0], data.strides[0]), writeable=False)
+    frames = data[starts[:, np.newaxis] + np.arange(nframe)]
+    frames.flags.writeable = False
+    return frames
+
+
+def iter_frames(data, nframe, ov, dtype=np.float64):
+    """
+    Generate each frame as a view of data.
+    """
+    data = np.asarray(data, dtype=dtype)
+    for start in frame_starts(len(data), nframe, ov):
+        yield data[start:start + nframe]
+
+
+def amplitude_spectrum(frames, p_filter=0.97, dtype=np.float64, padding=False, workers=1, highpass=False):
+    """
+    Get amplitude spectrum (number of frames x fft_length(N, padding)/2) of frame matrix (number of frames x N).
+    It is the part of batch_mfcc not depending on filter bank, so it can be cached and reused.
+    """
+    frames = np.asarray(frames, dtype=dtype)
+    return get_spectrum_plan(frames.shape[1], p_filter, dtype, padding, workers, highpass).amplitude_spectrum(frames)
+
+
+def spectrum_mfcc(fft_data, fs, N, numChannels=20, cutpoint=12, fo=0.4, mel=1000, dtype=np.float64, padding=False):
+    """
+    Get MFCC matrix (number of frames x cutpoint) from amplitude_spectrum of frames of length N.
+    spectrum_mfcc(amplitude_spectrum(frames, p_filter), fs, N, ...) is batch_mfcc(frames, fs, ..., p_filter).
+    """
+    return get_plan(fs, N, numChannels, cutpoint, fo, mel, dtype=dtype, padding=padding).cepstrum(fft_data)
+
+
+def sweep_mfcc(fft_data, fs, N, configs, dtype=np.float64, padding=False):
+    """
+    Get MFCC of every configuration (numChannels, cutpoint, fo, mel) in configs from one amplitude_spectrum.
+    Return MFCC tensor (configs x number of frames x max cutpoint) and zero division flag of each configuration.
+    MFCC of configs[c] is [c, :, :cutpoint], the same as spectrum_mfcc(fft_data, fs, N, *configs[c]).
+    """
+    return get_sweep_plan(fs, N, configs, dtype, padding).cepstrum(fft_data)
+
+
+BUCKET_SIZE = 1 << 16 #1回の FFT にまとめる最大サンプル数。キャッシュに収まる大きさ
+
+
+def length_buckets(lengths, padding=False, max_size=BUCKET_SIZE):
+    """
+    Group record numbers by FFT length fft_length(N, padding) of each record length N.
+    Without padding, a bucket has records of the same length. With padding, records of different lengths
+    padded to the same fast length share a bucket. Buckets over max_size samples are split.
+    Return list of (fft_size, record numbers) in order of fft_size.
+    """
+    buckets = {}
+    for i, N in enumerate(lengths):
+        buckets.setdefault(fft_length(N, padding), []).append(i)
+    chunks = []
+    for fft_size in sorted(buckets):
+        numbers = buckets[fft_size]
+        rows = max(1, max_size // max(fft_size, 1))
+        for start in range(0, len(numbers), rows):
+            chunks.append((fft_size, numbers[start:start + rows]))
+    return chunks
+
+
+def padded_spectrum(records, p_filter=0.97, dtype=np.float64, padding=False, workers=1, highpass=False):
+    """
+    Get amplitude spectrum (records x fft_size/2) of records with the same fft_length(len(record), padding).
+    Each record is pre-emphasized and windowed with hamming window of its own length, then zero padded to fft_size,
+    so each row is the same as amplitude_spectrum of the record alone. One FFT is done for all records.
+    """
+    lengths = np.array([len(record) for record in records], dtype=np.intp)
+    signals = np.zeros((len(records), lengths.max()), dtype=dtype)
+    for r, record in enumerate(records):
+        signals[r, :lengths[r]] = record
+    #フィルタの後に窓をかけるので、0で埋めた部分に出たプリエンファシスの値は窓で消える
+    windows = np.zeros(signals.shape, dtype=dtype)
+    for N in np.unique(lengths):
+        windows[lengths == N, :N] = np.hamming(N)
+    plan = get_spectrum_plan(int(lengths[0]), p_filter, dtype, padding, workers, highpass)
+    return plan.transform(windows * pre_emphasis(signals, p_filter, dtype=dtype))
+
+
+def bucket_mfcc(records, fs, numChannels=20, cutpoint=12, fo=0.4, mel=1000, p_filter=0.97, dtype=np.float64, padding=False,
+                workers=1, highpass=False):
+    """
+    Get MFCC of each whole record in a list of records of various lengths.
+    Result of each record is the same as MFCCclass(record, fs, len(record), ...).mfcc(), but records are grouped
+    with length_buckets and each bucket is one FFT, one filter bank product and one DCT.
+    Return list of MFCC in the order of records, None where zero division occurred.
+    """
+    records = [np.asarray(record, dtype=dtype) for record in records]
+    results = [None] * len(records)
+    for fft_size, numbers in length_buckets([len(record) for record in records], padding):
+        bucket = [records[i] for i in numbers]
+        fft_data = padded_spectrum(bucket, p_filter, dtype, padding, workers, highpass)
+        #フィルタバンクは FFT の長さだけで決まるので、バケットの最初の記録のプランを使う
+        plan = get_plan(fs, len(bucket[0]), numChannels, cutpoint, fo, mel, p_filter, dtype, padding, workers, highpass)
+        ceps, zero_division = plan.masked_cepstrum(fft_data)
+        for row, i in enumerate(numbers):
+            if not zero_division[row]:
+                results[i] = ceps[row]
+    return results
+
+
+def bucket_delta_cepstrum(records, fs, nframe, ov, numChannels=20, cutpoint=12, fo=0.4, mel=1000, p_filter=0.97, dtype=np.float64,
+                          padding=False, workers=1, highpass=False, max_size=BUCKET_SIZE):
+    """
+    Get delta-cepstrum of frames of each record in a list of records of various lengths.
+    Result of each record is the same as batch_delta_cepstrum(batch_mfcc(frame_signal(record, nframe, ov), fs, ...)).
+    This is frame_signal, bucket_frame_mfcc and batch_delta_cepstrum of each record in turn; call them separately to time each step.
+    Return list of delta-cepstrum in the order of records, None where zero division occurred or record has under 2 frames.
+    """
+    frames = [frame_signal(record, nframe, ov, dtype) for record in records] #フレーム行列は記録のビュー
+    mfcc_list = bucket_frame_mfcc(frames, fs, numChannels, cutpoint, fo, mel, p_filter, dtype, padding, workers, highpass, max_size)
+    return [frame_delta_cepstrum(ceps) for ceps in mfcc_list]
+
+
+def frame_delta_cepstrum(ceps):
+    """
+    batch_delta_cepstrum of MFCC matrix of one record from bucket_frame_mfcc. Return None if ceps is None or has under 2 frames.
+    """
+    if ceps is None or len(ceps) < 2:
+        return None
+    return batch_delta_cepstrum(ceps)
+
+
+def bucket_frame_mfcc(frames, fs, numChannels=20, cutpoint=12, fo=0.4, mel=1000, p_filter=0.97, dtype=np.float64,
+                      padding=False, workers=1, highpass=False, max_size=BUCKET_SIZE):
+    """
+    Get MFCC matrix of frame matrix of each record in a list of frame matrices (number of frames x nframe).
+    All frames have length nframe, so frames of many records are stacked and transformed in one batch up to max_size samples.
+    Result of each record is the same as batch_mfcc(frames[i], fs, ...).
+    Return list of MFCC matrices in the order of frames, None where zero division occurred.
+    """
+    results = [None] * len(frames)
+    if len(frames) == 0:
+        return results
+    nframe = frames[0].shape[1]
+    plan = get_plan(fs, nframe, numChannels, cutpoint, fo, mel, p_filter, dtype, padding, workers, highpass)
+    start = 0
+    while start < len(frames):
+        #max_size を超えない範囲で続く記録のフレームをまとめる
+        stop = start + 1
+        count = len(frames[start])
+        while stop < len(frames) and (count + len(frames[stop])) * nframe <= max_size:
+            count += len(frames[stop])
+            stop += 1
+        ceps, zero_division = plan.masked_cepstrum(plan.spectrum_plan.amplitude_spectrum(np.concatenate(frames[start:stop])))
+        offset = 0
+        for i in range(start, stop):
+            count = len(frames[i])
+            if not zero_division[offset:offset + count].any():
+                results[i] = ceps[offset:offset + count]
+            offset += count
+        start = stop
+    return results
+
+
 def delta_cepstrum(mfcc_list, cutpoint=12):
     """
     Calculate delta-cepstrum.
     """
-    delta_cepstrum = []
-    for i in range(cutpoint):
-        cov = 0
-        k_std = 0
-        for kframe in range(len(mfcc_list)):
-            cov = cov + (kframe * mfcc_list[kframe][i])
-            k_std = k_std + kframe ** 2
-        delta_c = cov / k_std
-        delta_cepstrum.append(delta_c)
-    return delta_cepstrum
\ No newline at end of file
+    if len(mfcc_list) < 2:
+        raise ZeroDivisionError("delta-cepstrum needs 2 frames at least")
+    mfcc_matrix = np.asarray(mfcc_list, dtype=float)[:, :cutpoint]
+    return list(batch_delta_cepstrum(mfcc_matrix))
+
+
+def as_float_array(array):
+    """
+    Get array as float32 if it is float32, otherwise as float64.
+    """
+    array = np.asarray(array)
+    if array.dtype == np.float32:
+        return array
+    return np.asarray(array, dtype=np.float64)
+
+
+def batch_delta_cepstrum(mfcc_tensor):
+    """
+    Calculate delta-cepstrum of whole record in one reduction.
+    mfcc_tensor: (frames x coeffs) or (recordings x frames x coeffs) array.
+    Return regression slope over frames, (coeffs) or (recordings x coeffs).
+    """
+    mfcc_tensor = as_float_array(mfcc_tensor)
+    nframes = mfcc_tensor.shape[-2]
+    k_std = (nframes - 1) * nframes * (2 * nframes - 1) // 6 #Σ k^2
+    if k_std == 0:
+        raise ZeroDivisionError("delta-cepstrum needs 2 frames at least")
+    k = np.arange(nframes, dtype=mfcc_tensor.dtype)
+    return np.matmul(k, mfcc_tensor) / k_std
+
+
+def regression_delta(mfcc_tensor, W=2):
+    """
+    Calculate local delta of each frame with regression window of +-W frames.
+    d_t = Σ_{n=1}^{W} n (c_{t+n} - c_{t-n}) / (2 Σ_{n=1}^{W} n^2). Edge frames are repeated at both ends.
+    mfcc_tensor: (frames x coeffs) or (recordings x frames x coeffs) array. Return the same shape.
+    """
+    mfcc_tensor = as_float_array(mfcc_tensor)
+    nframes = mfcc_tensor.shape[-2]
+    pad_width = [(0, 0)] * (mfcc_tensor.ndim - 2) + [(W, W), (0, 0)]
+    padded = np.pad(mfcc_tensor, pad_width, mode='edge')
+    delta = np.zeros(mfcc_tensor.shape, dtype=mfcc_tensor.dtype)
+    for n in range(1, W + 1):
+        delta += n * (padded[..., W + n:W + n + nframes, :] - padded[..., W - n:W - n + nframes, :])
+    return delta / (2 * sum(n ** 2 for n in range(1, W + 1)))
+
+
+def dynamic_features(mfcc_tensor, W=2):
+    """
+    Get whole record delta-cepstrum, local delta and delta-delta from one MFCC tensor.
+    mfcc_tensor: (frames x coeffs) or (recordings x frames x coeffs) array.
+    Return delta_cepstrum (... x coeffs), delta (... x frames x coeffs), delta_delta (... x frames x coeffs).
+    """
+    mfcc_tensor = as_float_array(mfcc_tensor)
+    delta = regression_delta(mfcc_tensor, W)
+    delta_delta = regression_delta(delta, W)
+    return batch_delta_cepstrum(mfcc_tensor), delta, delta_delta
+
+
+class DeltaCepstrum():
+    """
+    Incremental delta-cepstrum. Add MFCC of each frame with update() and get delta() at any time.
+    delta() is the same as delta_cepstrum of all frames given so far, and update() costs O(cutpoint).
+    """
+    def __init__(self, cutpoint=12):
+        self.count = 0 #フレーム数
+        self.cov = np.zeros(cutpoint) #Σ k * c_k
+
+
+    def update(self, ceps):
+        """
+        Add MFCC of next frame.
+        """
+        self.cov += self.count * np.asarray(ceps, dtype=float)
+        self.count += 1
+        return 0
+
+
+    def delta(self):
+        """
+        Get delta-cepstrum of current frames. Raise ZeroDivisionError under 2 frames like delta_cepstrum.
+        """
+        k_std = (self.count - 1) * self.count * (2 * self.count - 1) // 6 #Σ k^2
+        if k_std == 0:
+            raise ZeroDivisionError("delta-cepstrum needs 2 frames at least")
+        return self.cov / k_std
+
+
+class SlidingDeltaCepstrum(DeltaCepstrum):
+    """
+    Incremental delta-cepstrum of last window frames.
+    When the window is full, update() evicts the oldest frame. Frame numbers k restart from the oldest frame.
+    """
+    def __init__(self, window, cutpoint=12):
+        DeltaCepstrum.__init__(self, cutpoint)
+        self.window = window
+        self.frames = np.zeros((window, cutpoint)) #窓内のフレームのリングバッファ
+        self.first = 0 #最も古いフレームの位置
+        self.sum_c = np.zeros(cutpoint) #Σ c_k
+
+
+    def update(self, ceps):
+        """
+        Add MFCC of next frame. Evict the oldest frame if window is full.
+        """
+        if self.count == self.window:
+            self.evict()
+        ceps = np.asarray(ceps, dtype=float)
+        self.frames[(self.first + self.count) % self.window] = ceps
+        self.sum_c += ceps
+        return DeltaCepstrum.update(self, ceps)
+
+
+    def evict(self):
+        """
+        Remove the oldest frame. Other frame numbers decrease by 1, so Σ k * c_k decreases by Σ c_k of the rest.
+        """
+        if self.count == 0:
+            return 0
+        self.sum_c -= self.frames[self.first]
+        self.cov -= self.sum_c
+        self.first = (self.first + 1) % self.window
+        self.count -= 1
+        return 0
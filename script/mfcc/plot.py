@@ -0,0 +1,21 @@
+#coding:utf-8
+import numpy as np
+
+def plot_melfilterbank(filterbank, fs, N, fname):
+    """
+    Generate Mel-filterbank graph as fname_melfilterbank.png.
+    matplotlib is imported here, so importing mfcc module does not load it.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.clf()
+    #周波数解像度
+    df = fs / N
+    for i in np.arange(0, len(filterbank)):
+        plt.plot(np.arange(0,len(filterbank[i]))*df, filterbank[i])
+    plt.xlim(0, fs / 2)
+    plt.ylim(0, 1.0)
+    plt.xlabel("frequency")
+    plt.savefig(fname + '_melfilterbank.png')
+    return 0
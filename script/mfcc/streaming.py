@@ -0,0 +1,105 @@
+#coding:utf-8
+import numpy as np
+from . import mfcc
+
+
+class StreamingMFCC():
+    """
+    This class is to make MFCC of each frame from chunked real-time signal.
+    Frames are the same as mfcc.frame_signal(signal, nframe, ov) of all samples given so far,
+    and each MFCC is bit-identical to mfcc.batch_mfcc of that frame alone.
+    Batching many frames in one matrix product can change the last bits, so it differs from
+    mfcc.batch_mfcc(mfcc.frame_signal(...)) of the whole signal by about 3e-16 of the largest value
+    (run_benchmark.py checks it with --streaming-tolerance).
+    Memory is a ring buffer of fixed size and each chunk costs only the frames it completes.
+    """
+    def __init__(self, fs, nframe, ov, numChannels=20, cutpoint=12, fo=0.4, mel=1000, p_filter=0.97):
+        """
+        fs: sampling rate
+        nframe: window width
+        ov: overlap rate, 0 <= ov < 1
+        """
+        self.nframe = nframe
+        self.shift = nframe * (1 - ov)
+        if self.shift <= 0:
+            raise ValueError("overlap rate have to set 0 <= ov < 1.")
+        self.p_filter = p_filter
+        self.plan = mfcc.get_plan(fs, nframe, numChannels, cutpoint, fo, mel, p_filter)
+
+        #フレームの開始位置から判定位置までの長さは nframe + shift 未満なのでこれだけあれば足りる
+        self.capacity = 2 * nframe + int(np.ceil(self.shift)) + 1
+        self.raw_buffer = np.zeros(self.capacity) #入力信号のリングバッファ
+        self.emphasized_buffer = np.zeros(self.capacity) #プレエンファシス後のリングバッファ
+        self.frame = np.zeros((1, nframe)) #出力するフレームの作業領域
+        self.zi = None #チャンクをまたいで引き継ぐプレエンファシスの状態(前のチャンクの最後のサンプル)
+        self.received = 0 #受け取ったサンプル数
+        self.frame_number = 0 #次に出力するフレーム番号
+        self.shift_number = 0 #フレームの出力を判定するシフト位置の番号
+
+
+    def frame_start(self, k):
+        """
+        Get start number of frame k, the same as mfcc.frame_starts.
+        """
+        return int(self.shift * k)
+
+
+    def ready(self):
+        """
+        Frame is output when a shift position after its end has been received, as offline framing requires.
+        """
+        end = self.frame_start(self.frame_number) + self.nframe
+        while self.frame_start(self.shift_number) < end:
+            self.shift_number += 1
+        return self.shift * self.shift_number <= self.received
+
+
+    def read_frame(self):
+        """
+        Copy current frame from ring buffer. The first sample is not pre-emphasized, like filtering each frame.
+        """
+        start = self.frame_start(self.frame_number)
+        first = start % self.capacity
+        length = min(self.nframe, self.capacity - first)
+        self.frame[0, :length] = self.emphasized_buffer[first:first + length]
+        self.frame[0, length:] = self.emphasized_buffer[:self.nframe - length]
+        self.frame[0, 0] = self.raw_buffer[first]
+        return self.frame
+
+
+    def write(self, raw, emphasized):
+        """
+        Write samples to ring buffer.
+        """
+        first = self.received % self.capacity
+        length = min(len(raw), self.capacity - first)
+        self.raw_buffer[first:first + length] = raw[:length]
+        self.raw_buffer[:len(raw) - length] = raw[length:]
+        self.emphasized_buffer[first:first + length] = emphasized[:length]
+        self.emphasized_buffer[:len(raw) - length] = emphasized[length:]
+        self.received += len(raw)
+        return 0
+
+
+    def push(self, chunk):
+        """
+        Input chunk of any size. Return MFCC matrix (number of completed frames x cutpoint).
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if len(chunk) == 0:
+            return np.zeros((0, self.plan.dct_basis.shape[0]))
+        emphasized = mfcc.pre_emphasis(chunk, self.p_filter, self.zi)
+        self.zi = chunk[-1]
+        ceps_list = []
+        position = 0
+        while position < len(chunk):
+            #まだ出力していないフレームの開始位置より前のサンプルは上書きしてよい
+            space = self.capacity - (self.received - self.frame_start(self.frame_number))
+            length = min(space, len(chunk) - position)
+            self.write(chunk[position:position + length], emphasized[position:position + length])
+            position += length
+            while self.ready():
+                frame = self.read_frame()
+                ceps_list.append(self.plan.cepstrum(self.plan.spectrum(frame))[0])
+                self.frame_number += 1
+        return np.array(ceps_list).reshape(len(ceps_list), self.plan.dct_basis.shape[0])
@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import contextlib
+import numpy as np
+#my module
+from benchmark import synthetic
+from benchmark import stages
+from benchmark import import_time
+
+
+def benchmark_main(work_fpath, config, recordings, length, repeat):
+    """
+    Time run_mfcc.main end to end over generated supervise_data tree.
+    work_fpath/supervise_data is input and work_fpath/script is the working directory of run_mfcc.
+    Each run uses new feature cache, spectrum cache, signal store and directory index, so every timed run reads and calculates all recordings.
+    """
+    import run_mfcc
+    supervise_data_fpath = work_fpath + "/supervise_data"
+    threshold_variable_list = ["0div10mag", "1div10mag"]
+    place_name_list = ["PLACE_A", "PLACE_B"]
+    synthetic.write_supervise_data(supervise_data_fpath, threshold_variable_list, place_name_list, recordings, length, config["fs"])
+    script_fpath = work_fpath + "/script"
+    os.makedirs(script_fpath, exist_ok=True)
+    main_config = dict(config)
+    main_config["supervise_data_fpath"] = "../supervise_data/"
+    main_config["place_name_fpath"] = "../supervise_data/" + threshold_variable_list[0] + "/supervise_label_1"
+    main_config["pkl_folder_fpath"] = "../pkl_file"
+    runs = [0]
+
+    cwd = os.getcwd()
+    argv = sys.argv
+    try:
+        os.chdir(script_fpath)
+        sys.argv = ["run_mfcc.py"]
+        def run():
+            #前の実行のキャッシュを使わないように、実行ごとに新しいフォルダにする
+            main_config["cache_fpath"] = "../pkl_file_cache_{}".format(runs[0])
+            for key, fpath in [("spectrum_cache_fpath", "../spectrum_cache_{}"), ("signal_store_fpath", "../signal_store_{}"),
+                               ("directory_index_fpath", "../directory_index_{}.json")]:
+                if config.get(key, ""):
+                    main_config[key] = fpath.format(runs[0])
+            runs[0] += 1
+            with open("./config.json", 'w', encoding='utf-8') as f:
+                json.dump(main_config, f, indent=4)
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                run_mfcc.main()
+        seconds = stages.measure(run, repeat)
+    finally:
+        os.chdir(cwd)
+        sys.argv = argv
+    samples = len(threshold_variable_list) * 2 * len(place_name_list) * sum(
+        [length, synthetic.next_prime(length)][i % 2] for i in range(recordings))
+    return {"seconds" : seconds, "samples" : samples, "throughput" : samples / seconds}
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark each stage of MFCC with synthetic infrasound.")
+    parser.add_argument("--fs", type=float, default=None, help="sampling rate (default: fs in config.json)")
+    parser.add_argument("--length", type=int, default=20000, help="samples of one record. Its next prime number is also measured")
+    parser.add_argument("--recordings", type=int, default=4, help="recordings per label and place for end-to-end run")
+    parser.add_argument("--repeat", type=int, default=5, help="repeat count of each measurement")
+    parser.add_argument("--skip-main", action="store_true", help="do not measure end-to-end run_mfcc.main")
+    parser.add_argument("--output", default="benchmark_result.json", help="JSON file to write result")
+    parser.add_argument("--compare", default=None, help="baseline JSON file to compare throughput with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput decrease rate in compare mode")
+    parser.add_argument("--import-budget", type=float, default=0.5, help="allowed seconds to import MFCC core in fresh interpreter")
+    parser.add_argument("--dtype-tolerance", type=float, default=stages.FLOAT32_TOLERANCE, help="allowed relative error of float32 features against float64")
+    parser.add_argument("--streaming-tolerance", type=float, default=stages.STREAMING_TOLERANCE, help="allowed relative error of streaming MFCC against frame matrix MFCC")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open('./config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if args.fs is not None:
+        config["fs"] = args.fs
+    fs = config["fs"]
+    mfcc_params = (config["numChannels"], config["cutpoint"], config["fo"], config["mel"], config["p_filter"], config["nframe"], config["ov"])
+
+    result = {
+        "meta" : {
+            "fs" : fs,
+            "length" : args.length,
+            "repeat" : args.repeat,
+            "mfcc_params" : mfcc_params,
+            "python" : platform.python_version(),
+            "numpy" : np.__version__,
+            "date" : time.strftime("%Y-%m-%d %H:%M:%S")
+        },
+        "stages" : {},
+        "float32_error" : {},
+        "streaming_error" : {}
+    }
+    over_budget = False
+    over_tolerance = False
+    over_streaming_tolerance = False
+    for module in ["mfcc.mfcc", "mfcc.streaming"]:
+        seconds, loaded = import_time.measure_import_time(module, args.repeat)
+        result["stages"]["import[" + module + "]"] = {"seconds" : seconds, "samples" : 1, "throughput" : 1 / seconds}
+        if seconds > args.import_budget or len(loaded) > 0:
+            over_budget = True
+            print("Error: import {} takes {:.3f} sec (budget {} sec), heavy modules {}".format(module, seconds, args.import_budget, loaded))
+    for length in [args.length, synthetic.next_prime(args.length)]:
+        times, data = synthetic.generate_infrasound(length, fs, signal=True, seed=0)
+        print("Measure stages with N = {}".format(length))
+        for name, value in stages.benchmark_stages(data, fs, *mfcc_params, repeat=args.repeat).items():
+            result["stages"][name + "[N=" + str(length) + "]"] = value
+        for name, error in stages.compare_dtype(data, fs, *mfcc_params).items():
+            result["float32_error"][name + "[N=" + str(length) + "]"] = error
+            if error > args.dtype_tolerance:
+                over_tolerance = True
+        error = stages.compare_streaming(data, fs, *mfcc_params)
+        result["streaming_error"]["mfcc[N=" + str(length) + "]"] = error
+        if error > args.streaming_tolerance:
+            over_streaming_tolerance = True
+    if not args.skip_main:
+        print("Measure run_mfcc.main")
+        work_fpath = tempfile.mkdtemp()
+        try:
+            result["stages"]["main"] = benchmark_main(work_fpath, config, args.recordings, args.length, args.repeat)
+        finally:
+            shutil.rmtree(work_fpath)
+
+    for name, value in result["stages"].items():
+        print("{:<28} {:>12.6f} sec {:>16.1f} samples/sec".format(name, value["seconds"], value["throughput"]))
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=4)
+    for name, error in result["float32_error"].items():
+        print("float32 error {:<24} {:>12.3e} (tolerance {:.1e})".format(name, error, args.dtype_tolerance))
+    for name, error in result["streaming_error"].items():
+        print("streaming error {:<22} {:>12.3e} (tolerance {:.1e})".format(name, error, args.streaming_tolerance))
+    print("Write result to {}".format(args.output))
+
+    if over_budget:
+        print("Error: import time is over budget")
+        sys.exit(1)
+    if over_tolerance:
+        print("Error: error of float32 features is over tolerance {}".format(args.dtype_tolerance))
+        sys.exit(1)
+    if over_streaming_tolerance:
+        print("Error: error of streaming MFCC is over tolerance {}".format(args.streaming_tolerance))
+        sys.exit(1)
+
+    if args.compare is not None:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        comparison = stages.compare_results(baseline["stages"], result["stages"], args.tolerance)
+        regression = False
+        for name, base_throughput, throughput, ratio, is_regression in comparison:
+            if is_regression:
+                regression = True
+            print("{:<28} {:>8.2f}x {}".format(name, ratio, "REGRESSION" if is_regression else "ok"))
+        if regression:
+            print("Error: throughput regression over tolerance {}".format(args.tolerance))
+            sys.exit(1)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import numpy as np
+import shutil
+import os
+import sys
+import glob
+import json
+import argparse
+#my module
+from subscript import partition
+from subscript import feature_dataset
+from subscript import directory_index
+import run_mfcc
+
+
+def merge_feature_datasets(part_save_fpaths, save_fpath, **manifest_items):
+    """
+    Concatenate npy datasets of parts into one dataset sorted by recording number.
+    Raise ValueError if a recording number is in several parts. Return number of rows.
+    Parts without rows are skipped, because their feature dimension is 0.
+    """
+    features_list = []
+    labels_list = []
+    source_index_list = []
+    for part_save_fpath in part_save_fpaths:
+        features, labels, source_index, manifest = feature_dataset.read_feature_dataset(part_save_fpath, mmap_mode=None)
+        if len(source_index) == 0:
+            continue
+        features_list.append(features)
+        labels_list.append(labels)
+        source_index_list.append(source_index)
+    if len(features_list) == 0:
+        features_list = [np.zeros((0, 0))]
+        labels_list = [np.zeros(0, dtype=np.int64)]
+        source_index_list = [np.zeros(0, dtype=np.int64)]
+    source_index = np.concatenate(source_index_list)
+    if len(np.unique(source_index)) != len(source_index):
+        raise ValueError("{} has the same recording number in several parts.".format(save_fpath))
+    order = np.argsort(source_index, kind='stable')
+    features = np.concatenate(features_list)[order]
+    feature_dataset.write_feature_dataset(save_fpath, features, np.concatenate(labels_list)[order], source_index[order], **manifest_items)
+    return len(source_index)
+
+
+def merge_pickle_files(part_save_fpaths, save_fpath):
+    """
+    Copy pkl files of parts into save_fpath. Raise ValueError if a file name is in several parts. Return number of files.
+    """
+    number = 0
+    os.makedirs(save_fpath, exist_ok=True)
+    for part_save_fpath in part_save_fpaths:
+        for fpath in glob.glob(part_save_fpath + "/*.pkl"):
+            merged_fpath = save_fpath + "/" + os.path.basename(fpath)
+            if os.path.exists(merged_fpath):
+                raise ValueError("{} is in several parts.".format(merged_fpath))
+            shutil.copyfile(fpath, merged_fpath)
+            number += 1
+    return number
+
+
+def parse_args(config):
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Merge outputs of run_mfcc.py --shard i/N into one output folder.")
+    parser.add_argument("--manifest", default=config.get("partition_fpath", "../partition.json"), help="partition manifest (default: partition_fpath in config.json)")
+    parser.add_argument("--output", default=config["pkl_folder_fpath"], help="output folder (default: pkl_folder_fpath in config.json)")
+    return parser.parse_args()
+
+
+def main():
+    # JSONファイルを読み込む
+    with open('./config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    args = parse_args(config)
+    label_list = [config["label_1"], config["label_0"]] #ラベルの判定要素
+    pkl_folder_fpath = args.output #出力ファイルのフォルダパス
+
+    manifest = partition.read_manifest(args.manifest)
+    if manifest is None:
+        print("Error : partition manifest {} is not found.".format(args.manifest))
+        sys.exit()
+    parts = manifest["parts"]
+    part_fpaths = [partition.part_fpath(pkl_folder_fpath, part, parts) for part in range(parts)]
+    results = [partition.read_part_result(part_fpath) for part_fpath in part_fpaths]
+    unfinished = [part for part in range(parts) if results[part] is None]
+    if len(unfinished) > 0:
+        print("Error : parts {} are not finished.".format(unfinished))
+        sys.exit()
+    try:
+        partition.check_part_results(manifest, results)
+    except ValueError as e:
+        print("Error : {}".format(e))
+        sys.exit()
+    output_format = results[0]["output_format"]
+    feature_mode_list = results[0]["feature_mode_list"]
+    if any(result["output_format"] != output_format or result["feature_mode_list"] != feature_mode_list for result in results):
+        print("Error : parts have different output_format or feature modes. Run them with the same config.json")
+        sys.exit()
+
+    try:
+        shutil.rmtree(pkl_folder_fpath)
+        os.mkdir(pkl_folder_fpath)
+    except FileNotFoundError:
+        os.mkdir(pkl_folder_fpath)
+    print("Generate folder for pkl file.")
+    index = directory_index.DirectoryIndex(config["supervise_data_fpath"], config.get("directory_index_fpath", ""))
+    index.update()
+    run_mfcc.modify_file_structure(feature_mode_list, manifest["thresholds"], pkl_folder_fpath, label_list, index)
+
+    #観測点ごとに各部分の出力と件数をまとめる
+    generated_number = {}
+    zero_div_count = {}
+    for threshold_variable, place_name, csv_list in partition.manifest_groups(manifest):
+        group_name = threshold_variable + "/" + place_name
+        group_parts = [part for part in range(parts) if group_name in results[part]["counters"]]
+        for feature_mode in feature_mode_list:
+            relative_fpath = feature_mode + "/" + threshold_variable + "/" + place_name
+            save_fpath = pkl_folder_fpath + "/" + relative_fpath
+            part_save_fpaths = [part_fpaths[part] + "/" + relative_fpath for part in group_parts]
+            generated_number[(group_name, feature_mode)] = sum(results[part]["counters"][group_name][feature_mode][0] for part in group_parts)
+            zero_div_count[(group_name, feature_mode)] = sum(results[part]["counters"][group_name][feature_mode][1] for part in group_parts)
+            try:
+                if output_format == "npy":
+                    merged = merge_feature_datasets(part_save_fpaths, save_fpath,
+                        feature_mode=feature_mode, threshold_variable=threshold_variable, place_name=place_name,
+                        source_fpaths=[csv_fpath for label, csv_fpath in csv_list])
+                else:
+                    merged = merge_pickle_files(part_save_fpaths, save_fpath)
+            except ValueError as e:
+                print("Error : {}".format(e))
+                sys.exit()
+            if merged != generated_number[(group_name, feature_mode)]:
+                print("Error : {} has {} data but parts generated {}.".format(save_fpath, merged, generated_number[(group_name, feature_mode)]))
+                sys.exit()
+
+    for feature_mode in feature_mode_list:
+        for threshold_variable, place_name in manifest["groups"]:
+            group_name = threshold_variable + "/" + place_name
+            print("Save fpath = {}".format(pkl_folder_fpath + "/" + feature_mode + "/" + group_name))
+            print("Number of generating {} data = {}".format(output_format, generated_number[(group_name, feature_mode)]))
+            print("Zero division count = {}".format(zero_div_count[(group_name, feature_mode)]))
+    print("Merge {} parts : {} recordings, no recording is missing or duplicated.".format(parts, len(manifest["recordings"])))
+    print("Total number of generating {} data = {}".format(output_format, sum(generated_number.values())))
+    print("Total zero division count = {}".format(sum(zero_div_count.values())))
+    print("finish")
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -6,16 +6,30 @@ import os
 import glob
 import pickle
 import json
+import argparse
+import multiprocessing
+import time
+import warnings
+import collections
 #my module
 from mfcc import mfcc
 from subscript import operate_fpath
+from subscript import read_infrasound
+from subscript import feature_dataset
+from subscript import instrument
+from subscript import feature_cache
+from subscript import spectrum_cache
+from subscript import signal_store
+from subscript import pipeline
+from subscript import partition
+from subscript import directory_index
 
 def write_pickle(object_data, fpath):
     """
-    Save binary data with pickle module.
+    Save binary data with pickle module. The file is replaced atomically.
     
     """
-    with open(fpath, 'wb') as f:
+    with operate_fpath.atomic_open(fpath, 'wb') as f:
         pickle.dump(object_data, f)
     return 0
 
@@ -49,123 +63,182 @@ def transform_csv_format(*args):
     return feature
 
 
-def get_mfcc(data, fs, numChannels, cutpoint, fo, mel, p_filter):
+def get_mfcc(data, fs, numChannels, cutpoint, fo, mel, p_filter, dtype=np.float64, padding=False, highpass=False, fft_workers=1):
     """
     Get MFCC from mfcc script
     """
     N = len(data)
-    MFCCclass_obj = mfcc.MFCCclass(data, fs, N, numChannels, cutpoint, fo, mel, p_filter)
-    mfcc_data = MFCCclass_obj.mfcc()
+    with instrument.stage("mfcc"):
+        MFCCclass_obj = mfcc.MFCCclass(data, fs, N, numChannels, cutpoint, fo, mel, p_filter, dtype, padding, fft_workers, highpass)
+        mfcc_data = MFCCclass_obj.mfcc()
     return mfcc_data
 
 
-def separate_frame(data, nframe, ov):
+def separate_frame(data, nframe, ov, dtype=np.float64):
     """
     Separate data with nframe length including overlap.
     number of frame is, int(1 + ((N/ nframe) - 1) / (1 - ov))
+    Return read-only frame matrix (number of frames x nframe). It is a view of data if data is numpy array.
     """
     def restart_overlap_value(ov):
-        if ov < 0 or ov > 1:
+        if ov < 0 or ov >= 1:
             print("overlap rate have to set 0 < ov < 1.")
             sys.exit()
         return 0
 
-    def get_start_window(shift, N):
-        """
-        Get numbers array of window for overlap
-        """
-        start_window = []
-        i = 0
-        while shift * i <= N:
-            start_window.append(int(shift * i))
-            i+=1
-        return start_window
-
-    def get_comb_for_window(start_window, nframe):
-        """
-        Get combinations window both ends.
-        """
-        combs = []
-
-        for i in range(len(start_window)):
-            if start_window[i] + nframe <= start_window[-1]:
-                comb = (start_window[i], start_window[i] + nframe)
-                combs.append(comb)
-            else:
-                break
-        return combs
-    
-    def get_window_data(combs, data):
-        """
-        Get window data with output from get_comb_for_window function
-        """
-        all_sep_data = []
-        for comb in combs:
-            sep_data = []
-            start = comb[0]
-            end = comb[1]
-            for i in range(len(data)):
-                if i >= start and i < end:
-                    sep_data.append(data[i])
-                if i >= end or i == len(data)-1:
-                    all_sep_data.append(sep_data)
-                    break
-        return all_sep_data
-
     #debug
     restart_overlap_value(ov)
-
-    #edit now
-    N = len(data)
-    shift = nframe * (1 - ov)
-    
-    start_window = get_start_window(shift, N)
-    combs = get_comb_for_window(start_window, nframe)
-    all_sep_data = get_window_data(combs, data)
-    #edit end
-    return all_sep_data
+    return mfcc.frame_signal(data, nframe, ov, dtype)
 
 
-def get_delta_ceps(data, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov):
+def get_delta_ceps(data, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov, dtype=np.float64, padding=False, highpass=False,
+                   fft_workers=1):
     """
     Flow calculating delta cepstrum. The mfcc module does the calculation of delta cepstrum.
     bug:
     """
     #delta cepstrum
-    sep_data = separate_frame(data, nframe, ov)
-    mfcc_list = [get_mfcc(data, fs, numChannels, cutpoint, fo, mel, p_filter) for data in sep_data]
-    cutpoint = list(set([len(mfcc_data) for mfcc_data in mfcc_list]))[0]
-    delta_cepstrum = mfcc.delta_cepstrum(mfcc_list, cutpoint=cutpoint)
+    with instrument.stage("framing"):
+        sep_data = separate_frame(data, nframe, ov, dtype)
+    with instrument.stage("mfcc"):
+        mfcc_list = mfcc.batch_mfcc(sep_data, fs, numChannels, cutpoint, fo, mel, p_filter, dtype, padding, fft_workers, highpass)
+    with instrument.stage("delta"):
+        delta_cepstrum = mfcc.batch_delta_cepstrum(mfcc_list)
     return delta_cepstrum
 
 
-def choose_feature(feature_mode, label, data, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov):
+def get_spectra(data, fs, p_filter, nframe, ov, dtype=np.float64, padding=False, highpass=False, fft_workers=1):
     """
-    Adjust choice feature.
+    Get amplitude spectra of whole record and of each frame.
+    They are the part of get_mfcc and get_delta_ceps before filter bank, so spectrum cache keeps them.
     """
-    if feature_mode == 'mfcc_and_delta-ceps':
-        mfcc_data = get_mfcc(data, fs, numChannels, cutpoint, fo, mel, p_filter)
-        delta_ceps = get_delta_ceps(data, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov)
-        ML_format_data = transform_ML_format(label, mfcc_data, delta_ceps)
-        csv_format_data = transform_csv_format(mfcc_data, delta_ceps)
-    elif feature_mode == 'mfcc':
-        mfcc_data = get_mfcc(data, fs, numChannels, cutpoint, fo, mel, p_filter)
-        ML_format_data = transform_ML_format(label, mfcc_data)
-        csv_format_data = transform_csv_format(mfcc_data)
-    elif feature_mode == 'delta-ceps':
-        delta_ceps = get_delta_ceps(data, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov)
-        ML_format_data = transform_ML_format(label, delta_ceps)
-        csv_format_data = transform_csv_format(delta_ceps)
-    else:
+    with instrument.stage("framing"):
+        sep_data = separate_frame(data, nframe, ov, dtype)
+    with instrument.stage("spectrum"):
+        record = mfcc.amplitude_spectrum(np.asarray(data, dtype=dtype)[np.newaxis, :], p_filter, dtype, padding, fft_workers, highpass)
+        frames = mfcc.amplitude_spectrum(sep_data, p_filter, dtype, padding, fft_workers, highpass)
+    return {"N" : len(data), "record" : record, "frames" : frames}
+
+
+#各特徴量モードを構成する特徴量
+FEATURE_COMPONENTS = {
+    "mfcc_and_delta-ceps" : ["mfcc", "delta-ceps"],
+    "mfcc" : ["mfcc"],
+    "delta-ceps" : ["delta-ceps"]
+}
+
+
+def get_feature_names(feature_mode_list):
+    """
+    Get features used by feature_mode_list without duplication.
+    """
+    feature_names = []
+    for feature_mode in feature_mode_list:
+        if feature_mode not in FEATURE_COMPONENTS:
+            print("Error : Wrong inputing feature_mode. Modify script")
+            sys.exit()
+        feature_names += [name for name in FEATURE_COMPONENTS[feature_mode] if name not in feature_names]
+    return feature_names
+
+
+def extract_features(feature_mode_list, data, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov, dtype=np.float64, padding=False,
+                     highpass=False, fft_workers=1, spectra=None):
+    """
+    Calculate each feature used by feature_mode_list only once, so feature modes share MFCC and delta cepstrum.
+    If spectra from get_spectra is given, features are calculated from it and data is not used.
+    If a feature fails with zero division, the ZeroDivisionError is kept and choose_feature raises it.
+    Numerical RuntimeWarning is an error only in this calculation.
+    dtype is float64 or float32 for the whole calculation.
+    If padding is True, FFT length is padded to fast length. fft_workers is threads of FFT of large frame matrix.
+    If highpass is True, adaptive high-pass filter is applied to amplitude spectra (spectra are already filtered).
+    """
+    feature_names = get_feature_names(feature_mode_list)
+    features = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        for name in feature_names:
+            try:
+                if name == "mfcc" and spectra is None:
+                    features[name] = get_mfcc(data, fs, numChannels, cutpoint, fo, mel, p_filter, dtype, padding, highpass, fft_workers)
+                elif name == "delta-ceps" and spectra is None:
+                    features[name] = get_delta_ceps(data, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov, dtype, padding, highpass,
+                                                    fft_workers)
+                elif name == "mfcc":
+                    with instrument.stage("mfcc"):
+                        features[name] = mfcc.spectrum_mfcc(spectra["record"], fs, spectra["N"], numChannels, cutpoint, fo, mel, dtype, padding)[0]
+                elif name == "delta-ceps":
+                    with instrument.stage("mfcc"):
+                        mfcc_list = mfcc.spectrum_mfcc(spectra["frames"], fs, nframe, numChannels, cutpoint, fo, mel, dtype, padding)
+                    with instrument.stage("delta"):
+                        features[name] = mfcc.batch_delta_cepstrum(mfcc_list)
+            except ZeroDivisionError as e:
+                features[name] = e
+    return features
+
+
+#バッチ計算で None になった特徴量の例外
+BATCH_ZERO_DIVISION_MESSAGES = {
+    "mfcc" : "all filterbank outputs are zero",
+    "delta-ceps" : "delta-cepstrum needs 2 frames at least, or all filterbank outputs are zero"
+}
+
+
+def extract_batch_features(feature_mode_list, data_list, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov, dtype=np.float64,
+                           padding=False, highpass=False, fft_workers=1):
+    """
+    extract_features of many recordings at once. Recordings are grouped by length in mfcc.bucket_mfcc and
+    frames of all recordings are transformed together in mfcc.bucket_frame_mfcc.
+    Framing, MFCC and delta are timed as separate stages like get_delta_ceps.
+    Return list of features dict in the order of data_list.
+    """
+    feature_names = get_feature_names(feature_mode_list)
+    batch_features = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        if "mfcc" in feature_names:
+            with instrument.stage("mfcc"):
+                batch_features["mfcc"] = mfcc.bucket_mfcc(data_list, fs, numChannels, cutpoint, fo, mel, p_filter, dtype, padding,
+                                                          fft_workers, highpass)
+        if "delta-ceps" in feature_names:
+            with instrument.stage("framing"):
+                frames_list = [separate_frame(data, nframe, ov, dtype) for data in data_list]
+            with instrument.stage("mfcc"):
+                mfcc_lists = mfcc.bucket_frame_mfcc(frames_list, fs, numChannels, cutpoint, fo, mel, p_filter, dtype, padding,
+                                                    fft_workers, highpass)
+            with instrument.stage("delta"):
+                batch_features["delta-ceps"] = [mfcc.frame_delta_cepstrum(mfcc_list) for mfcc_list in mfcc_lists]
+    features_list = []
+    for i in range(len(data_list)):
+        features = {}
+        for name in feature_names:
+            feature = batch_features[name][i]
+            features[name] = feature if feature is not None else ZeroDivisionError(BATCH_ZERO_DIVISION_MESSAGES[name])
+        features_list.append(features)
+    return features_list
+
+
+def choose_feature(feature_mode, label, features):
+    """
+    Adjust choice feature from output of extract_features.
+    """
+    if feature_mode not in FEATURE_COMPONENTS:
         print("Error : Wrong inputing feature_mode. Modify script")
         sys.exit()
+    feature_list = []
+    for name in FEATURE_COMPONENTS[feature_mode]:
+        if isinstance(features[name], ZeroDivisionError):
+            raise features[name]
+        feature_list.append(features[name])
+    ML_format_data = transform_ML_format(label, *feature_list)
+    csv_format_data = transform_csv_format(*feature_list)
     return ML_format_data, csv_format_data
 
 
-def modify_file_structure(feature_mode_list, threshold_variable_list, pkl_folder_fpath, label_list):
+def modify_file_structure(feature_mode_list, threshold_variable_list, pkl_folder_fpath, label_list, index=None):
     """
     Modify File Structure for input machine learning.
     Because of being different from GSC file structure. This method is to the same structure of GSC directory.
+    With index (DirectoryIndex of supervise_data), folders are listed from the index.
     """
     for feature_mode in feature_mode_list:
         feature_fpath = pkl_folder_fpath + "/" + feature_mode
@@ -180,30 +253,36 @@ def modify_file_structure(feature_mode_list, threshold_variable_list, pkl_folder
             }
 
             for key_value in filepaths.items():           
-                folder_names = operate_fpath.get_all_multi_folder(key_value[1])
+                if index is not None:
+                    folder_names = index.get_all_multi_folder(key_value[1])
+                else:
+                    folder_names = operate_fpath.get_all_multi_folder(key_value[1])
                 for target_obs in folder_names:
                     pkl_target_fpath =  pkl_threshold_fpath + "/" + target_obs
                     os.mkdir(pkl_target_fpath)
     return 0
 
 
-def read_preprocessed_data(csv_fpath):
+def read_preprocessed_data(csv_fpath, dtype=np.float64, location=None):
     """
-    Read preprocessed infrasound data.
+    Read preprocessed infrasound data. Return InfAC as numpy array.
+    If location in signal store is given, the recording is a memmap slice of the store and csv file is not parsed.
     """
-    df = pd.read_csv(csv_fpath)
-    times = df["SensorTimeStamp"].tolist()
-    data = df["InfAC"].tolist()
-    if len(times) == 0 and len(data) == 0:
+    if location is not None:
+        data = np.asarray(signal_store.read_signal(location), dtype=dtype)
+    else:
+        data = read_infrasound.read_infrasound_csv(csv_fpath, dtype=dtype)
+    if len(data) == 0:
         print("Error: data is nothing.")
-    return times, data
+    return data
 
 
-def get_ML_object(label_list, threshold_variable, place_name, fs):
+def get_csv_list(label_list, threshold_variable, place_name, index=None):
     """
-    Generate object of transforming to MFCC.
+    Get [label, csv file path] of each recording. Position in the list is the recording number of output file names.
+    With index (DirectoryIndex of supervise_data), csv files are listed from the index instead of glob.
     """
-    write_ML_data = []
+    csv_list = []
 
     filepaths = {
         "label_signal" : "../supervise_data" + "/" + threshold_variable + "/" + "supervise_label_0",
@@ -222,27 +301,222 @@ def get_ML_object(label_list, threshold_variable, place_name, fs):
             sys.exit()
         
         place_fpath = label_fpath + "/" + place_name
-        csv_fpaths = glob.glob(place_fpath + "/*.csv")
+        if index is not None:
+            csv_fpaths = index.glob_csv(place_fpath)
+        else:
+            csv_fpaths = glob.glob(place_fpath + "/*.csv")
         for csv_fpath in csv_fpaths:
-            times, data = read_preprocessed_data(csv_fpath)
-            required_data = [label, fs, data]
-            write_ML_data.append(required_data)
-    return write_ML_data
+            csv_list.append([label, csv_fpath])
+    return csv_list
+
+
+def get_recording_groups(label_list, threshold_variable_list, place_name_list, index=None):
+    """
+    Get [(threshold_variable, place_name, csv_list of get_csv_list), ...] of every threshold and place.
+    """
+    groups = []
+    for threshold_variable in threshold_variable_list:
+        for place_name in place_name_list:
+            groups.append((threshold_variable, place_name, get_csv_list(label_list, threshold_variable, place_name, index)))
+    return groups
+
+
+def write_recording_features(i, label, features, save_fpaths, feature_mode_list, output_format):
+    """
+    Make each feature mode from features of one recording. If output_format is "pkl", write pkl file of each feature mode.
+    With "npy", main collects the features and writes them with feature_dataset module.
+    Return dict of feature mode and feature list, or None if zero division occurred.
+    """
+    written = {}
+    for feature_mode in feature_mode_list:
+        save_fpath = save_fpaths[feature_mode]
+        try:
+            ML_format_data, csv_format_data = choose_feature(feature_mode, label, features)
+            if output_format == "pkl":
+                save_fname_pkl = save_fpath + "/" + "label_" + str(label) + "_" + str(i) + "_" + feature_mode + ".pkl"
+                save_fname_csv = save_fpath + "/" + "label_" + str(label) + "_" + str(i) + "_" + feature_mode + ".csv"
+                write_pickle(ML_format_data, save_fname_pkl)
+                #write_csv(csv_format_data, save_fname_csv)
+            written[feature_mode] = csv_format_data
+        except ZeroDivisionError:
+            written[feature_mode] = None
+            print("Error: zero division calculating mean.")
+    return written
+
+
+#観測点ごとの準備の仕事 (prepare_shard)
+#store_shard_name      : signal store の中の観測点の名前
+#csv_fpaths            : 観測点の csv file path
+#known_entries         : 特徴量キャッシュの manifest にある各 csv の記録、なければ None
+#entry_fpath           : 特徴量キャッシュのフォルダパス
+#signal_store_fpath    : signal store のフォルダパス。空なら変換しない
+ShardTask = collections.namedtuple("ShardTask", ["store_shard_name", "csv_fpaths", "known_entries", "entry_fpath", "signal_store_fpath"])
+
+#1記録の特徴量を計算する仕事。プロセスプールに渡すので名前付きタプルにする
+#content_hash          : csv の内容のハッシュ
+#csv_fpath             : csv file path
+#location              : signal store の中の位置、なければ None
+#shard_name            : threshold_variable/place_name
+#fs, feature_mode_list, mfcc_params, fft_workers : 計算のパラメータ
+#entry_fpath           : 特徴量キャッシュのフォルダパス
+#spectrum_cache_config : (振幅スペクトルのキャッシュのフォルダパス, 最大バイト数)、使わなければ None
+#index                 : 出力ファイル名の記録番号
+FeatureTask = collections.namedtuple("FeatureTask", ["content_hash", "csv_fpath", "location", "shard_name", "fs", "feature_mode_list",
+    "mfcc_params", "fft_workers", "entry_fpath", "spectrum_cache_config", "index"])
+
+
+def prepare_shard(task):
+    """
+    Get content hash of each csv file of one shard and convert csv files whose features are not cached into signal store.
+    This runs in process pool before features are calculated, so csv files are hashed and parsed on all workers.
+    task is ShardTask.
+    Return (entry of feature cache manifest of each csv file, location in signal store of each csv file or None,
+    number of parsed csv files, seconds of hashing and conversion).
+    """
+    start = time.perf_counter()
+    entries = [feature_cache.input_entry(csv_fpath, entry) for csv_fpath, entry in zip(task.csv_fpaths, task.known_entries)]
+    if not task.signal_store_fpath:
+        return entries, [None] * len(task.csv_fpaths), 0, time.perf_counter() - start
+    needed = [not feature_cache.has_features(task.entry_fpath, entry["hash"]) for entry in entries]
+    locations, parsed = signal_store.SignalStore(task.signal_store_fpath).update_shard(task.store_shard_name, task.csv_fpaths, needed)
+    return entries, locations, parsed, time.perf_counter() - start
+
+
+def read_task_input(task, prefetch=False):
+    """
+    Read input of one FeatureTask: spectra in spectrum cache, or preprocessed data if the spectra are not cached.
+    With prefetch, memmap of signal store is copied into memory, so the disk is read in this call.
+    Return (data, spectra). One of them is None.
+    """
+    numChannels, cutpoint, fo, mel, p_filter, nframe, ov, dtype, padding, highpass = task.mfcc_params
+    if task.spectrum_cache_config is not None:
+        key = spectrum_cache.spectrum_key(task.content_hash, task.fs, p_filter, nframe, ov, dtype, padding, highpass)
+        spectra = spectrum_cache.get_cache(*task.spectrum_cache_config).get(key)
+        if spectra is not None:
+            return None, spectra
+    with instrument.stage("read"):
+        data = read_preprocessed_data(task.csv_fpath, dtype, task.location)
+        if prefetch and task.location is not None:
+            data = np.array(data)
+    return data, None
+
+
+def compute_batch(batch, inputs):
+    """
+    Calculate features of each task of batch from its input of read_task_input.
+    Without spectrum cache, several recordings are calculated together with extract_batch_features.
+    With spectrum cache, spectra not in the cache are calculated and put into it.
+    Return list of features dict in the order of batch.
+    """
+    fs, feature_mode_list, mfcc_params, fft_workers = batch[0].fs, batch[0].feature_mode_list, batch[0].mfcc_params, batch[0].fft_workers
+    spectrum_cache_config = batch[0].spectrum_cache_config
+    if len(batch) > 1 and spectrum_cache_config is None:
+        return extract_batch_features(feature_mode_list, [data for data, spectra in inputs], fs, *mfcc_params, fft_workers=fft_workers)
+    numChannels, cutpoint, fo, mel, p_filter, nframe, ov, dtype, padding, highpass = mfcc_params
+    features_list = []
+    for task, (data, spectra) in zip(batch, inputs):
+        if spectra is None and spectrum_cache_config is not None:
+            spectra = get_spectra(data, fs, p_filter, nframe, ov, dtype, padding, highpass, fft_workers)
+            key = spectrum_cache.spectrum_key(task.content_hash, fs, p_filter, nframe, ov, dtype, padding, highpass)
+            spectrum_cache.get_cache(*spectrum_cache_config).put(key, spectra)
+        features_list.append(extract_features(feature_mode_list, data, fs, *mfcc_params, fft_workers=fft_workers, spectra=spectra))
+    return features_list
+
+
+def store_batch(batch, features_list):
+    """
+    Store features of each task of batch in feature cache.
+    """
+    with instrument.stage("serialization"):
+        for task, features in zip(batch, features_list):
+            feature_cache.store_features(task.entry_fpath, task.content_hash, features)
+    return 0
+
+
+def batch_results(batch, inputs, features_list, start):
+    """
+    Get (content hash, shard name, recording number, features, report of instrument module) of each task.
+    Report of the batch from start is divided among recordings in proportion to their samples.
+    """
+    samples = [spectra["N"] if spectra is not None else len(data) for data, spectra in inputs]
+    reports = instrument.split_report(instrument.finish_recording(start, sum(samples)), samples)
+    return [(task.content_hash, task.shard_name, task.index, features, report) for task, features, report in zip(batch, features_list, reports)]
+
+
+def run_batch_task(batch):
+    """
+    Read recordings of batch of tasks, calculate their features and store them in feature cache.
+    This is the unit of work of process pool. With spectrum cache, csv file is not read if its spectra are cached.
+    Return list of (content hash, shard name, recording number, features, report of instrument module (None if instrumentation is disabled)).
+    """
+    start = instrument.start_recording()
+    inputs = [read_task_input(task) for task in batch]
+    features_list = compute_batch(batch, inputs)
+    store_batch(batch, features_list)
+    return batch_results(batch, inputs, features_list, start)
+
+
+def run_recording_task(task):
+    """
+    run_batch_task of one recording. Return content hash, shard name, recording number, features and report.
+    """
+    return run_batch_task([task])[0]
+
+
+def read_batch(batch):
+    """
+    Read stage of pipeline. Prefetch inputs of batch of tasks in reader thread.
+    Return (inputs, stage times of the reader thread), so the read time goes into reports of the batch.
+    """
+    instrument.start_recording()
+    inputs = [read_task_input(task, prefetch=True) for task in batch]
+    return inputs, instrument.take_stage_times()
+
+
+def compute_batch_task(batch, read_output):
+    """
+    Compute stage of pipeline. Return results like run_batch_task, but features are not stored yet.
+    Read time of reader thread is added to stage times of reports, but not to latency.
+    """
+    inputs, read_times = read_output
+    start = instrument.start_recording()
+    features_list = compute_batch(batch, inputs)
+    results = batch_results(batch, inputs, features_list, start)
+    instrument.add_batch_stages([report for content_hash, shard_name, i, features, report in results], read_times)
+    return results
+
+
+def store_batch_results(entries):
+    """
+    Write stage of pipeline. Store features of [(batch, results of compute_batch_task), ...] in feature cache.
+    Serialization time of each batch is added to stage times of its reports.
+    """
+    for batch, results in entries:
+        instrument.start_recording()
+        store_batch(batch, [features for content_hash, shard_name, i, features, report in results])
+        instrument.add_batch_stages([report for content_hash, shard_name, i, features, report in results], instrument.take_stage_times())
+    return 0
+
+
+def parse_args():
+    """
+    Parse command line arguments. They take priority over config.json.
+    """
+    parser = argparse.ArgumentParser(description="Extract infrasound feature with MFCC and delta-cepstrum.")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: workers in config.json)")
+    parser.add_argument("--instrument-log", default=None, help="JSON-lines file of stage timing report (default: instrument_log in config.json, empty is disabled)")
+    parser.add_argument("--partition", type=int, default=None, help="write partition manifest of N parts (partition_fpath in config.json) and exit")
+    parser.add_argument("--shard", type=partition.parse_part, default=None, help="process only part i/N (0 <= i < N) of partition manifest")
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
     # JSONファイルを読み込む
     with open('./config.json', 'r', encoding='utf-8') as f:
         config = json.load(f)
 
     #init
-    """
-    object_dataの構造
-    object_data = [教師ラベル, サンプリングレート, データ列]
-    """
-    _label_number = 0 #object_dataのラベルが書かれている要素番号
-    _fs_number = 1 #object_dataのサンプリングレートが書かれている要素番号
-    _data_number = 2 #object_dataのデータが書かれている要素番号
     feature_mode_list = ["mfcc_and_delta-ceps", "mfcc", "delta-ceps"] #生成する特徴量の種類
     label_list = [config["label_1"], config["label_0"]] #ラベルの判定要素
     supervise_data_fpath = config["supervise_data_fpath"] #教師データのフォルダパス
@@ -255,49 +529,238 @@ def main():
     p_filter = config["p_filter"] #プリエンファシスフィルタ
     ov = config["ov"] #オーバーラップ率
     nframe = config["nframe"] #窓幅
+    dtype = config.get("dtype", "float64") #計算の精度 "float64" または "float32"
+    if dtype not in ["float64", "float32"]:
+        print("Error : dtype have to be float64 or float32. Modify config.json")
+        sys.exit()
+    fft_length = config.get("fft_length", "exact") #FFTの長さ "exact" : 記録の長さ, "fast" : 次の 5-smooth 数まで0で埋める
+    if fft_length not in ["exact", "fast"]:
+        print("Error : fft_length have to be exact or fast. Modify config.json")
+        sys.exit()
+    padding = (fft_length == "fast")
+    highpass = config.get("highpass", False) #振幅スペクトルに適応ハイパスフィルタをかけるか
+    fft_workers = config.get("fft_workers", 1) #大きなフレーム行列の FFT のスレッド数。-1 なら全CPU
+    workers = args.workers if args.workers is not None else config.get("workers", 1) #並列処理のプロセス数
+    batch_recordings = config.get("batch_recordings", 1) #まとめて計算する記録数。1なら1記録ずつ
+    pipeline_readers = config.get("pipeline_readers", 0) #先読みする読み込みスレッド数。0ならパイプラインを使わない
+    pipeline_queue_depth = config.get("pipeline_queue_depth", 4) #段階の間で待てるバッチ数の上限
+    output_format = config.get("output_format", "pkl") #出力形式 "npy" : 観測点ごとに1つの行列, "pkl" : 1記録ごとに1ファイル
+    if output_format not in ["npy", "pkl"]:
+        print("Error : output_format have to be npy or pkl. Modify config.json")
+        sys.exit()
+    partition_fpath = config.get("partition_fpath", "../partition.json") #分割実行のマニフェストのファイルパス
+    directory_index_fpath = config.get("directory_index_fpath", "") #教師データのフォルダ構成の索引のファイルパス。空なら保存しない
+    #Folders and csv files of supervise_data are listed once. Only folders changed since the saved index are read again.
+    index = directory_index.DirectoryIndex(supervise_data_fpath, directory_index_fpath)
+    scanned = index.update()
+    print("Index supervise_data : {} of {} folders are read.".format(scanned, len(index.folders)))
+    if args.partition is not None:
+        if args.partition < 1:
+            print("Error : number of parts have to be 1 or more.")
+            sys.exit()
+        threshold_variable_list = index.get_all_multi_folder(supervise_data_fpath)
+        place_name_list = index.get_all_multi_folder(place_name_fpath)
+        groups = get_recording_groups(label_list, threshold_variable_list, place_name_list, index)
+        manifest = partition.make_manifest(groups, args.partition, threshold_variable_list)
+        partition.write_manifest(partition_fpath, manifest)
+        for part in range(args.partition):
+            part_sizes = [recording["size"] for recording in manifest["recordings"] if recording["part"] == part]
+            print("Part {} : {} recordings, {} bytes".format(part, len(part_sizes), sum(part_sizes)))
+        print("Write partition manifest {} ({}).".format(partition_fpath, manifest["id"]))
+        return 0
+    manifest = None
+    if args.shard is not None:
+        part, parts = args.shard
+        manifest = partition.read_manifest(partition_fpath)
+        if manifest is None or manifest["parts"] != parts:
+            print("Error : partition manifest of {} parts is not found. Make it with --partition {}".format(parts, parts))
+            sys.exit()
+    instrument_log = args.instrument_log if args.instrument_log is not None else config.get("instrument_log", "") #計測ログのファイルパス。空なら計測しない
+    if instrument_log:
+        instrument.enable()
+        run_report = instrument.RunReport(instrument_log)
+    else:
+        run_report = None
 
-    #Generate saving pkl file
+    #Generate saving pkl file. Feature cache is kept, so only new or changed recordings are calculated.
     pkl_folder_fpath = config["pkl_folder_fpath"] #出力ファイルのフォルダパス
+    cache_fpath = config.get("cache_fpath", pkl_folder_fpath + "_cache") #特徴量キャッシュのフォルダパス
+    spectrum_cache_fpath = config.get("spectrum_cache_fpath", "") #振幅スペクトルのキャッシュのフォルダパス。空なら使わない
+    spectrum_cache_config = (spectrum_cache_fpath, config.get("spectrum_cache_bytes", 1 << 30)) if spectrum_cache_fpath else None
+    signal_store_fpath = config.get("signal_store_fpath", "") #csv を変換したバイナリのフォルダパス。空なら毎回 csv を読む
+    if manifest is not None:
+        #分割実行では部分ごとの出力フォルダに書き、run_merge.py でまとめる
+        pkl_folder_fpath = partition.part_fpath(pkl_folder_fpath, part, parts)
     try:
         shutil.rmtree(pkl_folder_fpath)
         os.mkdir(pkl_folder_fpath)
     except FileNotFoundError:
         os.mkdir(pkl_folder_fpath)
 
-    #Get threshold variable directory
-    threshold_variable_list = operate_fpath.get_all_multi_folder(supervise_data_fpath)
-    place_name_list = operate_fpath.get_all_multi_folder(place_name_fpath)
+    #Get threshold variable directory. With --shard, recordings and their numbers are those of partition manifest.
+    if manifest is not None:
+        threshold_variable_list = manifest["thresholds"]
+        groups = partition.manifest_groups(manifest)
+        selected = partition.part_recordings(manifest, part)
+    else:
+        threshold_variable_list = index.get_all_multi_folder(supervise_data_fpath)
+        place_name_list = index.get_all_multi_folder(place_name_fpath)
+        groups = get_recording_groups(label_list, threshold_variable_list, place_name_list, index)
+        selected = None
     print("Generate folder for pkl file.")
-    modify_file_structure(feature_mode_list, threshold_variable_list, pkl_folder_fpath, label_list)
+    modify_file_structure(feature_mode_list, threshold_variable_list, pkl_folder_fpath, label_list, index)
+
+    #shard = (threshold_variable, place_name). Recording numbers are decided here, so output is the same with any workers.
+    print("Generate object data for transform feature...")
+    mfcc_params = (numChannels, cutpoint, fo, mel, p_filter, nframe, ov, dtype, padding, highpass)
+    cache = feature_cache.FeatureCache(cache_fpath, {
+        "fs" : fs,
+        "mfcc_params" : mfcc_params,
+        "features" : sorted(set(name for feature_mode in feature_mode_list for name in FEATURE_COMPONENTS[feature_mode]))
+    })
+    shards = []
+    shard_tasks = []
+    shard_recordings = [] #観測点ごとの [記録番号, ラベル, csv file path]
+    for threshold_variable, place_name, csv_list in groups:
+        indices = [i for i in range(len(csv_list)) if selected is None or (threshold_variable, place_name, i) in selected]
+        if selected is not None and len(indices) == 0:
+            continue
+        save_fpaths = {}
+        for feature_mode in feature_mode_list:
+            save_fpaths[feature_mode] = pkl_folder_fpath + "/" + feature_mode + "/" + threshold_variable + "/" + place_name
+            #modify_file_structure は supervise_label_0 の観測点だけを作るので、他の観測点のフォルダはここで作る
+            os.makedirs(save_fpaths[feature_mode], exist_ok=True)
+        shard_number = len(shards)
+        csv_fpaths = [csv_fpath for label, csv_fpath in csv_list]
+        shards.append([threshold_variable, place_name, save_fpaths, csv_fpaths])
+        store_shard_name = threshold_variable + "/" + place_name
+        if manifest is not None:
+            #同じ観測点を他の部分と並行して変換しても bin ファイルを取り合わない
+            store_shard_name = partition.part_fpath(store_shard_name, part, parts)
+        shard_csv_fpaths = [csv_fpaths[i] for i in indices]
+        shard_tasks.append(ShardTask(store_shard_name, shard_csv_fpaths, [cache.known_input(csv_fpath) for csv_fpath in shard_csv_fpaths],
+                                     cache.entry_fpath, signal_store_fpath))
+        shard_recordings.append([[i] + csv_list[i] for i in indices])
+
+    #csv のハッシュと signal store への変換は観測点ごとにプールで行い、特徴量がキャッシュにある記録は変換しない
+    pool = None
+    if workers > 1 and len(shard_tasks) > 0:
+        pool = multiprocessing.Pool(workers, instrument.enable, (bool(instrument_log),))
+    if pool is not None:
+        prepared = pool.imap(prepare_shard, shard_tasks)
+    else:
+        prepared = map(prepare_shard, shard_tasks)
+    recordings = [] #[shard number, recording number, label, content hash, csv file path, location in signal store]
+    parsed = 0
+    for shard_number, (entries, locations, shard_parsed, seconds) in enumerate(prepared):
+        parsed += shard_parsed
+        if run_report is not None:
+            run_report.add_shard_stage(shards[shard_number][0] + "/" + shards[shard_number][1], "read", seconds)
+        for (i, label, csv_fpath), entry, location in zip(shard_recordings[shard_number], entries, locations):
+            cache.set_input(csv_fpath, entry)
+            recordings.append([shard_number, i, label, entry["hash"], csv_fpath, location])
+    cache.save_manifest()
+    if signal_store_fpath:
+        print("Convert {} csv files into signal store.".format(parsed))
+
+    #Calculate recordings not in cache. Same content under several folders is calculated once.
+    tasks = []
+    queued = {} #内容のハッシュ -> 計算する記録の (shard number, recording number)
+    for shard_number, i, label, content_hash, csv_fpath, location in recordings:
+        if content_hash not in queued and not cache.has(content_hash):
+            queued[content_hash] = (shard_number, i)
+            shard_name = shards[shard_number][0] + "/" + shards[shard_number][1]
+            tasks.append(FeatureTask(content_hash, csv_fpath, location, shard_name, fs, feature_mode_list, mfcc_params, fft_workers,
+                                     cache.entry_fpath, spectrum_cache_config, i))
+    print("Calculate {} recordings. {} recordings use cache or the same content.".format(len(tasks), len(recordings) - len(tasks)))
+    if batch_recordings > 1:
+        #長さの近い記録を同じバッチにして、バッチの中で同じFFTの長さにまとまるようにする
+        tasks.sort(key=lambda task: task.location[2] if task.location is not None else os.path.getsize(task.csv_fpath))
+    batches = [tasks[k:k + batch_recordings] for k in range(0, len(tasks), max(1, batch_recordings))]
+    calculated = {}
+    if pipeline_readers > 0:
+        #読み込みスレッドが先読みし、計算はこのスレッドかプール、特徴量キャッシュへの書き込みは書き込みスレッドで行う
+        #プールの全プロセスが計算できるように、同時に渡すバッチ数は workers 以上にする
+        io_pipeline = pipeline.Pipeline(read_batch, compute_batch_task, store_batch_results, pipeline_readers, pipeline_queue_depth, pool,
+                                        max(pipeline_queue_depth, workers))
+        results = io_pipeline.run(batches)
+    elif pool is not None:
+        chunksize = max(1, len(batches) // (workers * 4))
+        results = pool.imap(run_batch_task, batches, chunksize)
+    else:
+        results = map(run_batch_task, batches)
+    reports = []
+    for batch_results in results:
+        for content_hash, shard_name, i, features, report in batch_results:
+            calculated[content_hash] = features
+            reports.append((shard_name, i, report))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    #パイプラインの書き込みスレッドは結果を受け取った後に serialization の時間を足すので、全部終わってから記録する
+    if run_report is not None:
+        for shard_name, i, report in reports:
+            run_report.add_recording(shard_name, i, report)
+    if pipeline_readers > 0:
+        pipeline.print_metrics(io_pipeline.metrics)
+        if run_report is not None:
+            line = {"event" : "pipeline"}
+            line.update(io_pipeline.metrics)
+            run_report.write_line(line)
+
+    #write pkl
+    pkl_file_number = [dict((feature_mode, 0) for feature_mode in feature_mode_list) for shard in shards]
+    zero_div_count = [dict((feature_mode, 0) for feature_mode in feature_mode_list) for shard in shards]
+    #npy形式では観測点ごとに [特徴量, ラベル, 記録番号] を集める
+    dataset = [dict((feature_mode, [[], [], []]) for feature_mode in feature_mode_list) for shard in shards]
+    for shard_number, i, label, content_hash, csv_fpath, location in recordings:
+        features = calculated[content_hash] if content_hash in calculated else cache.load(content_hash)
+        if run_report is not None and queued.get(content_hash) != (shard_number, i):
+            run_report.add_reused(shards[shard_number][0] + "/" + shards[shard_number][1], i,
+                                  "same_content" if content_hash in queued else "feature_cache")
+        start = time.perf_counter()
+        written = write_recording_features(i, label, features, shards[shard_number][2], feature_mode_list, output_format)
+        if run_report is not None and output_format == "pkl":
+            run_report.add_shard_stage(shards[shard_number][0] + "/" + shards[shard_number][1], "serialization", time.perf_counter() - start)
+        for feature_mode in feature_mode_list:
+            if written[feature_mode] is not None:
+                pkl_file_number[shard_number][feature_mode] += 1
+                if output_format == "npy":
+                    dataset[shard_number][feature_mode][0].append(written[feature_mode])
+                    dataset[shard_number][feature_mode][1].append(label)
+                    dataset[shard_number][feature_mode][2].append(i)
+            else:
+                zero_div_count[shard_number][feature_mode] += 1
+
+    if output_format == "npy":
+        for shard_number in range(len(shards)):
+            threshold_variable, place_name, save_fpaths, csv_fpaths = shards[shard_number]
+            for feature_mode in feature_mode_list:
+                features, labels, source_index = dataset[shard_number][feature_mode]
+                start = time.perf_counter()
+                feature_dataset.write_feature_dataset(save_fpaths[feature_mode], features, labels, source_index,
+                    feature_mode=feature_mode, threshold_variable=threshold_variable, place_name=place_name, source_fpaths=csv_fpaths)
+                if run_report is not None:
+                    run_report.add_shard_stage(threshold_variable + "/" + place_name, "serialization", time.perf_counter() - start)
 
-    #read csv data.
     for feature_mode in feature_mode_list:
-        for threshold_variable in threshold_variable_list:
-            for place_name in place_name_list:
-                zero_div_count = 0
-                save_fpath = pkl_folder_fpath + "/" + feature_mode + "/" + threshold_variable + "/" + place_name
-                print("Save fpath = {}".format(save_fpath))
-                print("Generate object data for transform feature...")
-                object_data = get_ML_object(label_list, threshold_variable, place_name, fs)
-                data_length = len(object_data)
-                #write pkl
-                pkl_file_number = 0
-                for i in range(data_length):
-                    label = object_data[i][_label_number]
-                    fs = object_data[i][_fs_number]
-                    cut_data = object_data[i][_data_number]
-                    try:
-                        ML_format_data, csv_format_data = choose_feature(feature_mode, label, cut_data, fs, numChannels, cutpoint, fo, mel, p_filter, nframe, ov)
-                        save_fname_pkl = save_fpath + "/" + "label_" + str(label) + "_" + str(i) + "_" + feature_mode + ".pkl"
-                        save_fname_csv = save_fpath + "/" + "label_" + str(label) + "_" + str(i) + "_" + feature_mode + ".csv"
-                        write_pickle(ML_format_data, save_fname_pkl)
-                        #write_csv(csv_format_data, save_fname_csv)
-                        pkl_file_number += 1
-                    except ZeroDivisionError:
-                        zero_div_count += 1
-                        print("Error: zero division calculating mean.")
-                print("Number of generating pkl file = {}".format(pkl_file_number))
-                print("Zero division count = {}".format(zero_div_count))
+        for shard_number in range(len(shards)):
+            print("Save fpath = {}".format(shards[shard_number][2][feature_mode]))
+            print("Number of generating {} data = {}".format(output_format, pkl_file_number[shard_number][feature_mode]))
+            print("Zero division count = {}".format(zero_div_count[shard_number][feature_mode]))
+    print("Total number of generating {} data = {}".format(output_format, sum(sum(count.values()) for count in pkl_file_number)))
+    print("Total zero division count = {}".format(sum(sum(count.values()) for count in zero_div_count)))
+    if manifest is not None:
+        counters = {}
+        for shard_number in range(len(shards)):
+            counters[shards[shard_number][0] + "/" + shards[shard_number][1]] = dict((feature_mode,
+                [pkl_file_number[shard_number][feature_mode], zero_div_count[shard_number][feature_mode]]) for feature_mode in feature_mode_list)
+        processed = [(shards[shard_number][0], shards[shard_number][1], i) for shard_number, i, label, content_hash, csv_fpath, location in recordings]
+        partition.write_part_result(pkl_folder_fpath, manifest, part, processed, counters,
+            output_format=output_format, feature_mode_list=feature_mode_list)
+        print("Finish part {} of {}. Merge outputs with run_merge.py after all parts finish.".format(part, parts))
+    if run_report is not None:
+        run_report.close()
     print("finish")
     return 0
 
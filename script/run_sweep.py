@@ -0,0 +1,198 @@
+import numpy as np
+import shutil
+import os
+import json
+import argparse
+import itertools
+#my module
+from mfcc import mfcc
+from subscript import operate_fpath
+from subscript import feature_dataset
+from subscript import feature_cache
+from subscript import spectrum_cache
+from subscript import signal_store
+from subscript import directory_index
+import run_mfcc
+
+SWEEP_MANIFEST_FNAME = "sweep.json"
+
+
+def get_configs(grid):
+    """
+    Get list of (numChannels, cutpoint, fo, mel) from grid {"numChannels" : [...], "fo" : [...], "mel" : [...], "cutpoint" : [...]}.
+    """
+    configs = []
+    for numChannels, fo, mel, cutpoint in itertools.product(grid["numChannels"], grid["fo"], grid["mel"], grid["cutpoint"]):
+        configs.append((numChannels, cutpoint, fo, mel))
+    return configs
+
+
+def config_name(config):
+    """
+    Folder name of one configuration.
+    """
+    numChannels, cutpoint, fo, mel = config
+    return "numChannels{}_cutpoint{}_fo{:g}_mel{:g}".format(numChannels, cutpoint, fo, mel)
+
+
+def sweep_features(spectra, fs, nframe, configs, dtype=np.float64, padding=False):
+    """
+    Calculate features of one recording for every configuration from its spectra (get_spectra of run_mfcc).
+    Return list of features dict of extract_features for each configuration.
+    """
+    record_ceps, record_zero_division = mfcc.sweep_mfcc(spectra["record"], fs, spectra["N"], configs, dtype, padding)
+    frame_ceps, frame_zero_division = mfcc.sweep_mfcc(spectra["frames"], fs, nframe, configs, dtype, padding)
+    try:
+        delta = mfcc.batch_delta_cepstrum(frame_ceps)
+    except ZeroDivisionError as e:
+        delta = e
+    ncoeffs = mfcc.get_sweep_plan(fs, nframe, configs, dtype, padding).ncoeffs
+    features_list = []
+    for c in range(len(configs)):
+        features = {}
+        if record_zero_division[c]:
+            features["mfcc"] = ZeroDivisionError("all filterbank outputs are zero")
+        else:
+            features["mfcc"] = record_ceps[c, 0, :ncoeffs[c]]
+        if isinstance(delta, ZeroDivisionError):
+            features["delta-ceps"] = delta
+        elif frame_zero_division[c]:
+            features["delta-ceps"] = ZeroDivisionError("all filterbank outputs are zero")
+        else:
+            features["delta-ceps"] = delta[c, :ncoeffs[c]]
+        features_list.append(features)
+    return features_list
+
+
+def parse_args(config):
+    """
+    Parse command line arguments. Grid is "sweep" in config.json, or numChannels, fo, mel and cutpoint of config.json.
+    """
+    grid = config.get("sweep", {})
+    parser = argparse.ArgumentParser(description="Extract infrasound feature for every MFCC parameter set of a grid.")
+    parser.add_argument("--numChannels", type=int, nargs="+", default=grid.get("numChannels", [config["numChannels"]]), help="number of filterbank")
+    parser.add_argument("--fo", type=float, nargs="+", default=grid.get("fo", [config["fo"]]), help="MFCC frequency parameter")
+    parser.add_argument("--mel", type=float, nargs="+", default=grid.get("mel", [config["mel"]]), help="mel scale parameter")
+    parser.add_argument("--cutpoint", type=int, nargs="+", default=grid.get("cutpoint", [config["cutpoint"]]), help="number of MFCC coefficients")
+    parser.add_argument("--output", default=config.get("sweep_folder_fpath", "../sweep_file"), help="output folder (default: sweep_folder_fpath in config.json)")
+    return parser.parse_args()
+
+
+def main():
+    # JSONファイルを読み込む
+    with open('./config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    args = parse_args(config)
+
+    #init
+    feature_mode_list = ["mfcc_and_delta-ceps", "mfcc", "delta-ceps"] #生成する特徴量の種類
+    label_list = [config["label_1"], config["label_0"]] #ラベルの判定要素
+    supervise_data_fpath = config["supervise_data_fpath"] #教師データのフォルダパス
+    place_name_fpath = config["place_name_fpath"] #観測点を抽出するための初期値
+    fs = config["fs"] #サンプリングレート
+    p_filter = config["p_filter"] #プリエンファシスフィルタ
+    ov = config["ov"] #オーバーラップ率
+    nframe = config["nframe"] #窓幅
+    dtype = config.get("dtype", "float64") #計算の精度 "float64" または "float32"
+    padding = (config.get("fft_length", "exact") == "fast") #FFTの長さを次の 5-smooth 数まで0で埋めるか
+    highpass = config.get("highpass", False) #振幅スペクトルに適応ハイパスフィルタをかけるか
+    fft_workers = config.get("fft_workers", 1) #大きなフレーム行列の FFT のスレッド数
+    spectrum_cache_fpath = config.get("spectrum_cache_fpath", "") #振幅スペクトルのキャッシュのフォルダパス。空なら使わない
+    if spectrum_cache_fpath:
+        cache = spectrum_cache.SpectrumCache(spectrum_cache_fpath, config.get("spectrum_cache_bytes", 1 << 30))
+        #csv の内容のハッシュは特徴量キャッシュの manifest から使い、サイズか更新時刻が変わった csv だけを読む
+        inputs = feature_cache.FeatureCache(config.get("cache_fpath", config["pkl_folder_fpath"] + "_cache"))
+    else:
+        cache = None
+    signal_store_fpath = config.get("signal_store_fpath", "") #csv を変換したバイナリのフォルダパス。空なら毎回 csv を読む
+    store = signal_store.SignalStore(signal_store_fpath) if signal_store_fpath else None
+    configs = get_configs({"numChannels" : args.numChannels, "fo" : args.fo, "mel" : args.mel, "cutpoint" : args.cutpoint})
+    sweep_folder_fpath = args.output #出力ファイルのフォルダパス
+    try:
+        shutil.rmtree(sweep_folder_fpath)
+        os.mkdir(sweep_folder_fpath)
+    except FileNotFoundError:
+        os.mkdir(sweep_folder_fpath)
+    print("Sweep {} configurations.".format(len(configs)))
+
+    #Get threshold variable directory
+    index = directory_index.DirectoryIndex(supervise_data_fpath, config.get("directory_index_fpath", ""))
+    index.update()
+    threshold_variable_list = index.get_all_multi_folder(supervise_data_fpath)
+    place_name_list = index.get_all_multi_folder(place_name_fpath)
+    print("Generate folder for npy file.")
+    for config_params in configs:
+        os.mkdir(sweep_folder_fpath + "/" + config_name(config_params))
+        run_mfcc.modify_file_structure(feature_mode_list, threshold_variable_list, sweep_folder_fpath + "/" + config_name(config_params), label_list, index)
+
+    #Spectra of each recording are calculated once and all configurations are calculated from them.
+    generated_number = [dict((feature_mode, 0) for feature_mode in feature_mode_list) for config_params in configs]
+    zero_div_count = [dict((feature_mode, 0) for feature_mode in feature_mode_list) for config_params in configs]
+    for threshold_variable in threshold_variable_list:
+        for place_name in place_name_list:
+            csv_list = run_mfcc.get_csv_list(label_list, threshold_variable, place_name, index)
+            if store is not None:
+                locations, parsed = store.update_shard(threshold_variable + "/" + place_name, [csv_fpath for label, csv_fpath in csv_list])
+            else:
+                locations = [None] * len(csv_list)
+            #設定ごとに [特徴量, ラベル, 記録番号] を集める
+            dataset = [dict((feature_mode, [[], [], []]) for feature_mode in feature_mode_list) for config_params in configs]
+            for i in range(len(csv_list)):
+                label, csv_fpath = csv_list[i]
+                spectra = None
+                if cache is not None:
+                    key = spectrum_cache.spectrum_key(inputs.content_hash(csv_fpath), fs, p_filter, nframe, ov, dtype, padding, highpass)
+                    spectra = cache.get(key)
+                if spectra is None:
+                    data = run_mfcc.read_preprocessed_data(csv_fpath, dtype, locations[i])
+                    spectra = run_mfcc.get_spectra(data, fs, p_filter, nframe, ov, dtype, padding, highpass, fft_workers)
+                    if cache is not None:
+                        cache.put(key, spectra)
+                features_list = sweep_features(spectra, fs, nframe, configs, dtype, padding)
+                for c in range(len(configs)):
+                    for feature_mode in feature_mode_list:
+                        try:
+                            ML_format_data, csv_format_data = run_mfcc.choose_feature(feature_mode, label, features_list[c])
+                            dataset[c][feature_mode][0].append(csv_format_data)
+                            dataset[c][feature_mode][1].append(label)
+                            dataset[c][feature_mode][2].append(i)
+                            generated_number[c][feature_mode] += 1
+                        except ZeroDivisionError:
+                            zero_div_count[c][feature_mode] += 1
+
+            for c in range(len(configs)):
+                numChannels, cutpoint, fo, mel = configs[c]
+                for feature_mode in feature_mode_list:
+                    save_fpath = sweep_folder_fpath + "/" + config_name(configs[c]) + "/" + feature_mode + "/" + threshold_variable + "/" + place_name
+                    features, labels, source_index = dataset[c][feature_mode]
+                    feature_dataset.write_feature_dataset(save_fpath, features, labels, source_index,
+                        feature_mode=feature_mode, threshold_variable=threshold_variable, place_name=place_name,
+                        source_fpaths=[csv_fpath for label, csv_fpath in csv_list],
+                        numChannels=numChannels, cutpoint=cutpoint, fo=fo, mel=mel)
+
+    if cache is not None:
+        inputs.save_manifest()
+
+    #設定とフォルダの対応
+    sweep_manifest = {
+        "fs" : fs,
+        "p_filter" : p_filter,
+        "nframe" : nframe,
+        "ov" : ov,
+        "dtype" : dtype,
+        "fft_length" : "fast" if padding else "exact",
+        "highpass" : highpass,
+        "configs" : [dict(zip(["numChannels", "cutpoint", "fo", "mel"], config_params), fpath=config_name(config_params)) for config_params in configs]
+    }
+    with operate_fpath.atomic_open(sweep_folder_fpath + "/" + SWEEP_MANIFEST_FNAME, 'w') as f:
+        json.dump(sweep_manifest, f, indent=4, ensure_ascii=False)
+
+    for c in range(len(configs)):
+        print("{} : number of generating npy data = {}, zero division count = {}".format(
+            config_name(configs[c]), sum(generated_number[c].values()), sum(zero_div_count[c].values())))
+    print("finish")
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import os
+import glob
+import json
+import time
+from subscript import operate_fpath
+
+INDEX_VERSION = 1
+RACY_MTIME_NS = 2 * 10 ** 9 #走査の直前に更新されたフォルダは次回も読み直す
+
+
+class DirectoryIndex():
+    """
+    Index of folders and csv files under root_fpath (supervise_data) made with os.scandir.
+    Each folder keeps its mtime, sub folder names and (name, size, mtime) of csv files in listing order,
+    so answers are the same as os.listdir and glob.glob. update() stats each indexed folder and scans again only
+    folders whose mtime changed, so an unchanged tree costs one stat per folder.
+    Adding, removing or renaming a file changes mtime of its folder, but rewriting a file does not,
+    so size and mtime of csv files are those at the last scan of the folder.
+    The index is kept in index_fpath (empty is not kept). Paths outside root_fpath are read from disk.
+    """
+    def __init__(self, root_fpath, index_fpath=""):
+        self.root_fpath = root_fpath
+        self.index_fpath = index_fpath
+        self.folders = {} #root_fpath からの相対パス -> {"mtime_ns", "folders", "files"}
+
+
+    def read_index(self):
+        """
+        Read persisted folders. Return {} if the index does not exist or was made for another root.
+        """
+        if not self.index_fpath:
+            return {}
+        try:
+            with open(self.index_fpath, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if index.get("version") != INDEX_VERSION or index.get("root") != os.path.abspath(self.root_fpath):
+            return {}
+        return index["folders"]
+
+
+    def update(self):
+        """
+        Bring the index up to date with the tree and save it if something changed. Return number of scanned folders.
+        """
+        old_folders = self.folders if len(self.folders) > 0 else self.read_index()
+        self.folders = {}
+        scan_start = time.time_ns()
+        scanned = self.scan("", old_folders, scan_start)
+        if scanned > 0 and self.index_fpath:
+            index = {"version" : INDEX_VERSION, "root" : os.path.abspath(self.root_fpath), "folders" : self.folders}
+            with operate_fpath.atomic_open(self.index_fpath, 'w') as f:
+                json.dump(index, f, ensure_ascii=False)
+        return scanned
+
+
+    def scan(self, relative_fpath, old_folders, scan_start):
+        """
+        Index folder relative_fpath and its sub folders. Return number of scanned folders.
+        """
+        fpath = self.absolute(relative_fpath)
+        mtime_ns = os.stat(fpath).st_mtime_ns
+        folder = old_folders.get(relative_fpath)
+        scanned = 0
+        if folder is None or folder["mtime_ns"] != mtime_ns:
+            folder = {"mtime_ns" : mtime_ns, "folders" : [], "files" : []}
+            with os.scandir(fpath) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        folder["folders"].append(entry.name)
+                    elif entry.name.endswith(".csv") and not entry.name.startswith("."):
+                        stat = entry.stat()
+                        folder["files"].append([entry.name, stat.st_size, stat.st_mtime_ns])
+            #同じ時刻のうちに更新されると mtime が変わらないので、新しいフォルダの mtime は信用しない
+            if mtime_ns >= scan_start - RACY_MTIME_NS:
+                folder["mtime_ns"] = None
+            scanned += 1
+        self.folders[relative_fpath] = folder
+        for name in folder["folders"]:
+            scanned += self.scan(name if relative_fpath == "" else relative_fpath + "/" + name, old_folders, scan_start)
+        return scanned
+
+
+    def absolute(self, relative_fpath):
+        return self.root_fpath if relative_fpath == "" else os.path.join(self.root_fpath, relative_fpath)
+
+
+    def relative(self, fpath):
+        """
+        Get path of fpath relative to root_fpath, or None if it is outside.
+        """
+        relative_fpath = os.path.relpath(os.path.normpath(fpath), os.path.normpath(self.root_fpath))
+        if relative_fpath == os.curdir:
+            return ""
+        if relative_fpath == os.pardir or relative_fpath.startswith(os.pardir + os.sep):
+            return None
+        return relative_fpath.replace(os.sep, "/")
+
+
+    def get_all_multi_folder(self, fpath):
+        """
+        Get sub folder names of fpath like operate_fpath.get_all_multi_folder.
+        """
+        folder = self.folders.get(self.relative(fpath))
+        if folder is None:
+            return operate_fpath.get_all_multi_folder(fpath)
+        return list(folder["folders"])
+
+
+    def get_csv_files(self, fpath):
+        """
+        Get [csv file path, size, mtime_ns] of csv files in fpath. Paths are the same as glob.glob(fpath + "/*.csv").
+        """
+        folder = self.folders.get(self.relative(fpath))
+        if folder is None:
+            csv_files = []
+            for csv_fpath in glob.glob(fpath + "/*.csv"):
+                stat = os.stat(csv_fpath)
+                csv_files.append([csv_fpath, stat.st_size, stat.st_mtime_ns])
+            return csv_files
+        return [[fpath + "/" + name, size, mtime_ns] for name, size, mtime_ns in folder["files"]]
+
+
+    def glob_csv(self, fpath):
+        """
+        Get csv file paths in fpath like glob.glob(fpath + "/*.csv").
+        """
+        return [csv_fpath for csv_fpath, size, mtime_ns in self.get_csv_files(fpath)]
+
+
+    def recordings(self):
+        """
+        Generate (threshold, label folder, place, csv file path, size, mtime_ns) of each csv file of
+        root_fpath/<threshold>/<label folder>/<place>/*.csv.
+        """
+        for threshold_variable in self.folders[""]["folders"]:
+            for label_folder in self.folders[threshold_variable]["folders"]:
+                label_relative_fpath = threshold_variable + "/" + label_folder
+                for place_name in self.folders[label_relative_fpath]["folders"]:
+                    place_fpath = self.absolute(label_relative_fpath + "/" + place_name).replace(os.sep, "/")
+                    for csv_fpath, size, mtime_ns in self.get_csv_files(place_fpath):
+                        yield threshold_variable, label_folder, place_name, csv_fpath, size, mtime_ns
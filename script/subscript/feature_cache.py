@@ -0,0 +1,123 @@
+import os
+import json
+import pickle
+import hashlib
+from subscript import operate_fpath
+
+MANIFEST_FNAME = "manifest.json"
+#特徴量の計算方法を変えた時はこの番号を上げてキャッシュを無効にする
+CACHE_VERSION = 1
+
+
+def hash_params(params):
+    """
+    Get short hash of parameter dict.
+    """
+    text = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def hash_file(fpath):
+    """
+    Get sha256 of file content.
+    """
+    sha256 = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def input_entry(fpath, entry=None):
+    """
+    Get {"size", "mtime_ns", "hash"} of input file. The file is read only when its size or mtime differs from entry.
+    """
+    stat = os.stat(fpath)
+    if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry
+    return {"size" : stat.st_size, "mtime_ns" : stat.st_mtime_ns, "hash" : hash_file(fpath)}
+
+
+def has_features(entry_fpath, content_hash):
+    """
+    Check that features of content_hash are stored. Called in worker processes.
+    """
+    return os.path.exists(os.path.join(entry_fpath, content_hash + ".pkl"))
+
+
+def store_features(entry_fpath, content_hash, features):
+    """
+    Write features of one recording atomically. Called in worker processes.
+    """
+    with operate_fpath.atomic_open(os.path.join(entry_fpath, content_hash + ".pkl"), 'wb') as f:
+        pickle.dump(features, f)
+    return 0
+
+
+class FeatureCache():
+    """
+    Cache of features of each recording for incremental and resumable runs.
+    cache_fpath/manifest.json : size, mtime and content hash of each input csv, and parameter sets
+    cache_fpath/<parameter hash>/<content hash>.pkl : features of one recording for one parameter set
+    Recordings with the same content share one entry, and changed parameters use another directory.
+    With params None, only content_hash is used (e.g. run_sweep.py) and no parameter directory is made.
+    """
+    def __init__(self, cache_fpath, params=None):
+        self.cache_fpath = cache_fpath
+        self.manifest = {"params" : {}, "inputs" : {}}
+        manifest_fpath = os.path.join(cache_fpath, MANIFEST_FNAME)
+        if os.path.exists(manifest_fpath):
+            with open(manifest_fpath, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        if params is None:
+            os.makedirs(cache_fpath, exist_ok=True)
+            return
+        params = dict(params)
+        params["cache_version"] = CACHE_VERSION
+        self.params_hash = hash_params(params)
+        self.entry_fpath = os.path.join(cache_fpath, self.params_hash)
+        os.makedirs(self.entry_fpath, exist_ok=True)
+        self.manifest["params"][self.params_hash] = params
+
+
+    def content_hash(self, fpath):
+        """
+        Get content hash of input file. The file is read only when its size or mtime changed.
+        """
+        entry = input_entry(fpath, self.known_input(fpath))
+        self.set_input(fpath, entry)
+        return entry["hash"]
+
+
+    def known_input(self, fpath):
+        """
+        Get entry of input file in manifest, or None. It may be out of date; check it with input_entry.
+        """
+        return self.manifest["inputs"].get(os.path.abspath(fpath))
+
+
+    def set_input(self, fpath, entry):
+        self.manifest["inputs"][os.path.abspath(fpath)] = entry
+        return 0
+
+
+    def has(self, content_hash):
+        return has_features(self.entry_fpath, content_hash)
+
+
+    def load(self, content_hash):
+        with open(os.path.join(self.entry_fpath, content_hash + ".pkl"), 'rb') as f:
+            return pickle.load(f)
+
+
+    def store(self, content_hash, features):
+        return store_features(self.entry_fpath, content_hash, features)
+
+
+    def save_manifest(self):
+        """
+        Write manifest atomically.
+        """
+        with operate_fpath.atomic_open(os.path.join(self.cache_fpath, MANIFEST_FNAME), 'w') as f:
+            json.dump(self.manifest, f, indent=4, ensure_ascii=False)
+        return 0
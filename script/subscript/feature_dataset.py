@@ -0,0 +1,64 @@
+import os
+import json
+import numpy as np
+from subscript import operate_fpath
+
+FEATURES_FNAME = "features.npy"
+LABELS_FNAME = "labels.npy"
+SOURCE_INDEX_FNAME = "source_index.npy"
+MANIFEST_FNAME = "manifest.json"
+
+
+def write_feature_dataset(save_fpath, features, labels, source_index, **manifest_items):
+    """
+    Write features of one shard as one contiguous matrix.
+    save_fpath/features.npy     : feature matrix (number of recordings x feature dimension), float32 if features are float32, otherwise float64
+    save_fpath/labels.npy       : label of each row
+    save_fpath/source_index.npy : recording number of each row, the number used in pkl file name
+    save_fpath/manifest.json    : shape, dtype, file names and manifest_items
+    Each file is replaced atomically and manifest is written last. save_fpath is made if it does not exist.
+    A shard without rows (no csv file, or zero division in every recording) is a 0 x 0 matrix.
+    """
+    features = np.asarray(features)
+    if features.dtype != np.float32:
+        features = features.astype(np.float64)
+    if features.ndim != 2:
+        if len(labels) == 0:
+            features = features.reshape(0, 0)
+        else:
+            features = features.reshape(len(labels), -1)
+    labels = np.asarray(labels, dtype=np.int64)
+    source_index = np.asarray(source_index, dtype=np.int64)
+    if not (len(features) == len(labels) == len(source_index)):
+        raise ValueError("features, labels and source_index have to be the same length.")
+    os.makedirs(save_fpath, exist_ok=True)
+
+    for fname, array in [(FEATURES_FNAME, features), (LABELS_FNAME, labels), (SOURCE_INDEX_FNAME, source_index)]:
+        with operate_fpath.atomic_open(os.path.join(save_fpath, fname), 'wb') as f:
+            np.save(f, array)
+    manifest = {
+        "number" : int(features.shape[0]),
+        "dimension" : int(features.shape[1]),
+        "dtype" : str(features.dtype),
+        "features" : FEATURES_FNAME,
+        "labels" : LABELS_FNAME,
+        "source_index" : SOURCE_INDEX_FNAME
+    }
+    manifest.update(manifest_items)
+    with operate_fpath.atomic_open(os.path.join(save_fpath, MANIFEST_FNAME), 'w') as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    return 0
+
+
+def read_feature_dataset(save_fpath, mmap_mode='r'):
+    """
+    Read features of one shard written by write_feature_dataset.
+    Arrays are memory-mapped, so nothing is copied until rows are used. Set mmap_mode=None to load them.
+    Return features, labels, source_index, manifest.
+    """
+    with open(os.path.join(save_fpath, MANIFEST_FNAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    features = np.load(os.path.join(save_fpath, manifest["features"]), mmap_mode=mmap_mode)
+    labels = np.load(os.path.join(save_fpath, manifest["labels"]), mmap_mode=mmap_mode)
+    source_index = np.load(os.path.join(save_fpath, manifest["source_index"]), mmap_mode=mmap_mode)
+    return features, labels, source_index, manifest
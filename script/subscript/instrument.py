@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import time
+import threading
+import itertools
+import contextlib
+import numpy as np
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#計測は既定で無効。無効の間 stage() は何もしないコンテキストを返すだけ
+_enabled = False
+_local = threading.local() #段階の時間はスレッドごと。パイプラインの読み込みスレッドの時間は混ざらない
+_null_context = contextlib.nullcontext()
+_batch_numbers = itertools.count() #プロセスの中のバッチの番号
+
+
+class _Stage():
+    """
+    Context adding wall time to the stage of current recording.
+    """
+    def __init__(self, name):
+        self.name = name
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        stage_times = _stage_times()
+        stage_times[self.name] = stage_times.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+def _stage_times():
+    """
+    Get stage times of current recording of this thread.
+    """
+    if not hasattr(_local, "stage_times"):
+        _local.stage_times = {}
+    return _local.stage_times
+
+
+def enable(flag=True):
+    """
+    Enable or disable instrumentation of this process. Use as initializer of process pool.
+    """
+    global _enabled
+    _enabled = flag
+    return 0
+
+
+def stage(name):
+    """
+    with instrument.stage("mfcc"): ... adds wall time to the stage of current recording.
+    """
+    if not _enabled:
+        return _null_context
+    return _Stage(name)
+
+
+def start_recording():
+    """
+    Clear stage times and return start time of one recording.
+    """
+    if not _enabled:
+        return None
+    _stage_times().clear()
+    return time.perf_counter()
+
+
+def finish_recording(start, samples):
+    """
+    Get report of one recording: latency, samples, stage times, peak RSS and process id.
+    Return None if instrumentation is disabled.
+    """
+    if not _enabled:
+        return None
+    return {
+        "latency" : time.perf_counter() - start,
+        "samples" : samples,
+        "stages" : dict(_stage_times()),
+        "peak_rss" : peak_rss(),
+        "pid" : os.getpid()
+    }
+
+
+def take_stage_times():
+    """
+    Get stage times of this thread measured since start_recording and clear them.
+    Use it in a thread which does a stage of a batch for another thread (pipeline reader or writer).
+    Return {} if instrumentation is disabled.
+    """
+    if not _enabled:
+        return {}
+    stage_times = dict(_stage_times())
+    _stage_times().clear()
+    return stage_times
+
+
+def add_batch_stages(reports, stage_times):
+    """
+    Add stage times of a whole batch measured in another thread to reports of its recordings from split_report,
+    in proportion to samples of each recording. Latency is not changed.
+    """
+    total = sum(report["samples"] for report in reports if report is not None)
+    for report in reports:
+        if report is None:
+            continue
+        share = report["samples"] / total if total > 0 else 1 / len(reports)
+        for name, seconds in stage_times.items():
+            report["stages"][name] = report["stages"].get(name, 0.0) + seconds * share
+    return 0
+
+
+def split_report(report, samples):
+    """
+    Divide report of a batch of recordings among the recordings in proportion to samples of each recording.
+    Latency and stage times of a recording are then its share of the batch, not measured for the recording alone.
+    Each report keeps "batch" : {"id", "recordings", "latency"} of the whole batch.
+    Return list of reports, or list of None if report is None.
+    """
+    if report is None:
+        return [None] * len(samples)
+    total = sum(samples)
+    batch = {"id" : "{}-{}".format(report["pid"], next(_batch_numbers)), "recordings" : len(samples), "latency" : report["latency"]}
+    reports = []
+    for n in samples:
+        share = n / total if total > 0 else 1 / len(samples)
+        reports.append(dict(report, latency=report["latency"] * share, samples=n, batch=batch,
+                            stages=dict((name, seconds * share) for name, seconds in report["stages"].items())))
+    return reports
+
+
+def peak_rss():
+    """
+    Get peak resident set size of this process in bytes. Return None if resource module is not available.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linuxはキロバイト、macOSはバイト
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def percentiles(values):
+    """
+    Get count, total, p50, p90, p99 and max of values.
+    """
+    if len(values) == 0:
+        return {"count" : 0}
+    values = np.asarray(values, dtype=float)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        "count" : int(len(values)),
+        "total" : float(values.sum()),
+        "p50" : float(p50),
+        "p90" : float(p90),
+        "p99" : float(p99),
+        "max" : float(values.max())
+    }
+
+
+class RunReport():
+    """
+    Write JSON-lines log of each recording and shard, and make summary at the end of run.
+    """
+    def __init__(self, log_fpath):
+        self.log_file = open(log_fpath, 'w', encoding='utf-8')
+        self.start = time.perf_counter()
+        self.shards = {} #シャード名 -> 記録ごとのレポートのリスト
+        self.reused = {} #シャード名 -> 計算しなかった記録の数
+        self.shard_stages = {} #シャード名 -> シャード単位の段階の時間(npy書き込みなど)
+
+
+    def write_line(self, line):
+        self.log_file.write(json.dumps(line, ensure_ascii=False) + "\n")
+        return 0
+
+
+    def add_recording(self, shard_name, i, report):
+        """
+        Add report of one calculated recording from finish_recording. i is the recording number of output file names.
+        """
+        self.shards.setdefault(shard_name, []).append(report)
+        line = {"event" : "recording", "shard" : shard_name, "index" : i, "source" : "calculated"}
+        line.update(report)
+        return self.write_line(line)
+
+
+    def add_reused(self, shard_name, i, source):
+        """
+        Add recording not calculated in this run. source is "feature_cache", or "same_content" if a recording
+        with the same content was calculated.
+        """
+        self.reused[shard_name] = self.reused.get(shard_name, 0) + 1
+        return self.write_line({"event" : "recording", "shard" : shard_name, "index" : i, "source" : source})
+
+
+    def add_shard_stage(self, shard_name, name, seconds):
+        """
+        Add wall time of stage done once per shard.
+        """
+        stages = self.shard_stages.setdefault(shard_name, {})
+        stages[name] = stages.get(name, 0.0) + seconds
+        return 0
+
+
+    def summarize(self, reports, shard_stages):
+        """
+        Summarize reports of recordings. If recordings were calculated in batches of several recordings,
+        "latency" and stage times are shares of batches ("batch_share" is true) and "batch_latency" is the latency of whole batches.
+        """
+        stage_names = sorted(set(name for report in reports for name in report["stages"]) | set(shard_stages))
+        samples = sum(report["samples"] for report in reports)
+        latency = [report["latency"] for report in reports]
+        stages = {}
+        for name in stage_names:
+            stages[name] = percentiles([report["stages"][name] for report in reports if name in report["stages"]])
+            if name in shard_stages:
+                stages[name]["shard_total"] = shard_stages[name]
+        rss = [report["peak_rss"] for report in reports if report["peak_rss"] is not None]
+        batches = dict((report["batch"]["id"], report["batch"]) for report in reports)
+        return {
+            "recordings" : len(reports),
+            "samples" : samples,
+            "latency" : percentiles(latency),
+            "batch_share" : any(batch["recordings"] > 1 for batch in batches.values()),
+            "batch_latency" : percentiles([batch["latency"] for batch in batches.values()]),
+            "samples_per_sec" : samples / sum(latency) if sum(latency) > 0 else None,
+            "stages" : stages,
+            "peak_rss" : max(rss) if len(rss) > 0 else None
+        }
+
+
+    def close(self):
+        """
+        Write summary of each shard and whole run, print the run summary and close log.
+        """
+        all_reports = []
+        all_shard_stages = {}
+        for shard_name in dict.fromkeys(list(self.shards) + list(self.reused) + list(self.shard_stages)):
+            reports = self.shards.get(shard_name, [])
+            shard_stages = self.shard_stages.get(shard_name, {})
+            line = {"event" : "shard", "shard" : shard_name}
+            line.update(self.summarize(reports, shard_stages))
+            line["reused"] = self.reused.get(shard_name, 0)
+            self.write_line(line)
+            all_reports += reports
+            for name, seconds in shard_stages.items():
+                all_shard_stages[name] = all_shard_stages.get(name, 0.0) + seconds
+        summary = self.summarize(all_reports, all_shard_stages)
+        summary["reused"] = sum(self.reused.values())
+        summary["wall_time"] = time.perf_counter() - self.start
+        summary["wall_samples_per_sec"] = summary["samples"] / summary["wall_time"]
+        summary["main_peak_rss"] = peak_rss()
+        line = {"event" : "summary"}
+        line.update(summary)
+        self.write_line(line)
+        self.log_file.close()
+
+        print("Run report: {} recordings ({} from cache or same content), {} samples, wall time {:.3f} sec, {:.1f} samples/sec".format(
+            summary["recordings"], summary["reused"], summary["samples"], summary["wall_time"], summary["wall_samples_per_sec"]))
+        if summary["batch_share"]:
+            print("Times of recordings are their shares of batches of batch_recordings.")
+        print("{:<16} {:>10} {:>10} {:>10} {:>10}".format("stage [sec]", "total", "p50", "p90", "p99"))
+        for name, value in list(summary["stages"].items()) + [("latency", summary["latency"]), ("batch latency", summary["batch_latency"])]:
+            if value["count"] > 0:
+                print("{:<16} {:>10.4f} {:>10.6f} {:>10.6f} {:>10.6f}".format(name, value["total"], value["p50"], value["p90"], value["p99"]))
+            if "shard_total" in value:
+                print("{:<16} {:>10.4f} (once per shard)".format(name, value["shard_total"]))
+        print("Peak RSS of workers = {} bytes".format(summary["peak_rss"]))
+        return summary
@@ -1,5 +1,6 @@
 import os
 import glob
+import contextlib
 
 def MultiGetSavePathandTime(fpath, vol_place, obs_place):
     """
@@ -70,6 +71,23 @@ def get_all_multi_folder(fpath):
     return files_dir
 
 
+@contextlib.contextmanager
+def atomic_open(fpath, mode='wb'):
+    """
+    Open temporary file and replace fpath with it after writing.
+    Readers see the old file or the complete new file, never a partly written one.
+    """
+    tmp_fpath = fpath + ".tmp" + str(os.getpid())
+    try:
+        with open(tmp_fpath, mode) as f:
+            yield f
+        os.replace(tmp_fpath, fpath)
+    except BaseException:
+        if os.path.exists(tmp_fpath):
+            os.remove(tmp_fpath)
+        raise
+
+
 def SingleGetSavePathandTime(fpath, folder):
     """
     Get save path and JMA got observation time only one.
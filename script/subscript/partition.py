@@ -0,0 +1,184 @@
+import os
+import json
+import hashlib
+from subscript import operate_fpath
+
+PARTITION_VERSION = 1
+PART_RESULT_FNAME = "part.json"
+
+
+def parse_part(text):
+    """
+    Parse "i/N" of --shard option into (i, N). 0 <= i < N.
+    """
+    try:
+        part, parts = [int(value) for value in text.split("/")]
+    except ValueError:
+        raise ValueError("shard have to be i/N.")
+    if parts < 1 or not 0 <= part < parts:
+        raise ValueError("shard have to be i/N with 0 <= i < N.")
+    return part, parts
+
+
+def part_fpath(fpath, part, parts):
+    """
+    Output folder of part i of N next to the output folder of the whole run.
+    """
+    return "{}.part{}of{}".format(fpath, part, parts)
+
+
+def assign_parts(sizes, parts):
+    """
+    Split recordings into parts contiguous ranges of about the same bytes.
+    Recording k goes to the part containing the middle of its bytes in cumulative sizes.
+    Return part number of each recording.
+    """
+    total = sum(sizes)
+    assigned = []
+    offset = 0
+    for k, size in enumerate(sizes):
+        if total > 0:
+            part = int(parts * (offset + size / 2) / total)
+        else:
+            part = k * parts // max(len(sizes), 1)
+        assigned.append(min(part, parts - 1))
+        offset += size
+    return assigned
+
+
+def make_manifest(groups, parts, threshold_variable_list):
+    """
+    Make partition manifest of groups [(threshold_variable, place_name, [[label, csv file path], ...]), ...].
+    Index of each recording is its position in the group, the recording number of output file names,
+    so every node numbers recordings the same way even if its directory listing order differs.
+    """
+    recordings = []
+    for threshold_variable, place_name, csv_list in groups:
+        for i, (label, csv_fpath) in enumerate(csv_list):
+            recordings.append({
+                "threshold" : threshold_variable,
+                "place" : place_name,
+                "index" : i,
+                "label" : label,
+                "fpath" : csv_fpath,
+                "size" : os.path.getsize(csv_fpath)
+            })
+    for recording, part in zip(recordings, assign_parts([recording["size"] for recording in recordings], parts)):
+        recording["part"] = part
+    group_names = [[threshold_variable, place_name] for threshold_variable, place_name, csv_list in groups]
+    text = json.dumps([parts, list(threshold_variable_list), group_names, recordings], sort_keys=True)
+    return {
+        "version" : PARTITION_VERSION,
+        "id" : hashlib.sha256(text.encode()).hexdigest()[:16],
+        "parts" : parts,
+        "thresholds" : list(threshold_variable_list),
+        "groups" : group_names,
+        "recordings" : recordings
+    }
+
+
+def write_manifest(manifest_fpath, manifest):
+    with operate_fpath.atomic_open(manifest_fpath, 'w') as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    return 0
+
+
+def read_manifest(manifest_fpath):
+    """
+    Read partition manifest. Return None if it does not exist or its version is old.
+    """
+    try:
+        with open(manifest_fpath, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get("version") != PARTITION_VERSION:
+        return None
+    return manifest
+
+
+def manifest_groups(manifest):
+    """
+    Get groups [(threshold_variable, place_name, [[label, csv file path], ...]), ...] of manifest in its order.
+    """
+    csv_lists = dict(((threshold_variable, place_name), []) for threshold_variable, place_name in manifest["groups"])
+    for recording in manifest["recordings"]:
+        csv_lists[(recording["threshold"], recording["place"])].append([recording["label"], recording["fpath"]])
+    return [(threshold_variable, place_name, csv_lists[(threshold_variable, place_name)])
+            for threshold_variable, place_name in manifest["groups"]]
+
+
+def part_recordings(manifest, part):
+    """
+    Get set of (threshold_variable, place_name, index) of recordings of part.
+    """
+    return set((recording["threshold"], recording["place"], recording["index"])
+               for recording in manifest["recordings"] if recording["part"] == part)
+
+
+def write_part_result(output_fpath, manifest, part, recordings, counters, **result_items):
+    """
+    Write result of one part. It is written at the end of the run, so a part without it is not finished.
+    recordings : [(threshold_variable, place_name, index), ...] processed in this part
+    counters   : {"threshold_variable/place_name" : {feature_mode : [generated, zero division]}}
+    """
+    result = {
+        "manifest" : manifest["id"],
+        "part" : part,
+        "parts" : manifest["parts"],
+        "recordings" : [list(recording) for recording in recordings],
+        "counters" : counters
+    }
+    result.update(result_items)
+    with operate_fpath.atomic_open(os.path.join(output_fpath, PART_RESULT_FNAME), 'w') as f:
+        json.dump(result, f, indent=4, ensure_ascii=False)
+    return 0
+
+
+def read_part_result(output_fpath):
+    """
+    Read result of one part. Return None if the part is not finished.
+    """
+    try:
+        with open(os.path.join(output_fpath, PART_RESULT_FNAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def check_part_results(manifest, results):
+    """
+    Check that results of all parts cover each recording of manifest exactly once,
+    and counters of each part add up to its recordings. Raise ValueError with the problems found.
+    """
+    expected = set((recording["threshold"], recording["place"], recording["index"]) for recording in manifest["recordings"])
+    seen = set()
+    duplicated = []
+    unknown = []
+    errors = []
+    for part, result in enumerate(results):
+        if result["manifest"] != manifest["id"] or result["part"] != part or result["parts"] != manifest["parts"]:
+            errors.append("part {} was made with another manifest".format(part))
+            continue
+        group_count = {}
+        for threshold_variable, place_name, i in result["recordings"]:
+            key = (threshold_variable, place_name, i)
+            if key in seen:
+                duplicated.append(key)
+            elif key not in expected:
+                unknown.append(key)
+            seen.add(key)
+            group_name = threshold_variable + "/" + place_name
+            group_count[group_name] = group_count.get(group_name, 0) + 1
+        for group_name, counter in result["counters"].items():
+            for feature_mode, (generated, zero_division) in counter.items():
+                if generated + zero_division != group_count.get(group_name, 0):
+                    errors.append("part {} {} {}: {} generated and {} zero division for {} recordings".format(
+                        part, group_name, feature_mode, generated, zero_division, group_count.get(group_name, 0)))
+    missing = sorted(expected - seen)
+    for name, keys in [("missing", missing), ("duplicated", duplicated), ("unknown", unknown)]:
+        if len(keys) > 0:
+            errors.append("{} {} recordings (first: {})".format(len(keys), name, "/".join(str(value) for value in keys[0])))
+    if len(errors) > 0:
+        raise ValueError("; ".join(errors))
+    return 0
@@ -0,0 +1,256 @@
+import time
+import queue
+import threading
+import collections
+
+_END = object() #キューの終わりの印
+
+
+class _Failure():
+    """
+    Exception raised in reader thread, passed to compute stage through read queue.
+    """
+    def __init__(self, error):
+        self.error = error
+
+
+class QueueMetrics():
+    """
+    Depth of bounded queue sampled at each put.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.puts = 0
+        self.depth_sum = 0
+        self.max_depth = 0
+        self.lock = threading.Lock()
+
+
+    def sample(self, depth):
+        with self.lock:
+            self.puts += 1
+            self.depth_sum += depth
+            self.max_depth = max(self.max_depth, depth)
+        return 0
+
+
+    def summary(self):
+        return {
+            "capacity" : self.capacity,
+            "mean_depth" : self.depth_sum / self.puts if self.puts > 0 else 0.0,
+            "max_depth" : self.max_depth
+        }
+
+
+class StageMetrics():
+    """
+    Time of one stage. busy is time in the stage function, wait is time blocked on empty input queue,
+    stall is time blocked on full output queue (backpressure from the next stage).
+    """
+    def __init__(self, threads):
+        self.threads = threads
+        self.items = 0
+        self.busy = 0.0
+        self.wait = 0.0
+        self.stall = 0.0
+        self.lock = threading.Lock()
+
+
+    def add(self, busy=0.0, wait=0.0, stall=0.0, items=0):
+        with self.lock:
+            self.busy += busy
+            self.wait += wait
+            self.stall += stall
+            self.items += items
+        return 0
+
+
+    def summary(self, wall):
+        return {
+            "threads" : self.threads,
+            "items" : self.items,
+            "busy" : self.busy,
+            "wait" : self.wait,
+            "stall" : self.stall,
+            "utilization" : self.busy / (self.threads * wall) if wall > 0 else 0.0
+        }
+
+
+class Pipeline():
+    """
+    Read, compute and write items in three stages connected by bounded queues.
+    readers threads call read_function(item) and prefetch inputs of next items. compute_function(item, inputs) runs
+    in the calling thread, or in process pool if pool is given. One writer thread calls write_function with list of
+    (item, output) waiting in write queue, so writes are batched behind compute.
+    With pool, up to in_flight items (default: queue_depth) are computed at once; set it to the number of processes or more
+    to keep every process busy. A stage blocks when the next queue has queue_depth items,
+    so at most about 2 * queue_depth + readers + in_flight items are in memory.
+    """
+    def __init__(self, read_function, compute_function, write_function, readers=2, queue_depth=4, pool=None, in_flight=None):
+        if in_flight is None:
+            in_flight = queue_depth
+        if readers < 1 or queue_depth < 1 or in_flight < 1:
+            raise ValueError("readers, queue_depth and in_flight have to be 1 or more.")
+        self.read_function = read_function
+        self.compute_function = compute_function
+        self.write_function = write_function
+        self.readers = readers
+        self.queue_depth = queue_depth
+        self.pool = pool
+        self.in_flight = in_flight
+        self.metrics = None
+
+
+    def run(self, items):
+        """
+        Generate output of compute_function for each item in order of completion. Output is yielded after it is queued to writer.
+        Exception of read_function or compute_function is raised here, exception of write_function at the end.
+        self.metrics is set to summarize() after the generator finishes.
+        """
+        start = time.perf_counter()
+        read_queue = queue.Queue(self.queue_depth)
+        write_queue = queue.Queue(self.queue_depth)
+        self.read_queue_metrics = QueueMetrics(self.queue_depth)
+        self.write_queue_metrics = QueueMetrics(self.queue_depth)
+        self.stage_metrics = {
+            "read" : StageMetrics(self.readers),
+            "compute" : StageMetrics(1),
+            "write" : StageMetrics(1)
+        }
+        self.write_error = None
+
+        item_iter = iter(items)
+        item_lock = threading.Lock()
+        running = [self.readers]
+        reader_threads = [threading.Thread(target=self._read_loop, args=(item_iter, item_lock, read_queue, running), daemon=True)
+                          for r in range(self.readers)]
+        writer_thread = threading.Thread(target=self._write_loop, args=(write_queue,), daemon=True)
+        for thread in reader_threads + [writer_thread]:
+            thread.start()
+
+        compute = self.stage_metrics["compute"]
+        pending = collections.deque() #プールで計算中の (item, AsyncResult)
+        while True:
+            t0 = time.perf_counter()
+            entry = read_queue.get()
+            compute.add(wait=time.perf_counter() - t0)
+            if entry is _END:
+                break
+            item, inputs = entry
+            if isinstance(inputs, _Failure):
+                raise inputs.error
+            if self.pool is None:
+                t0 = time.perf_counter()
+                output = self.compute_function(item, inputs)
+                compute.add(busy=time.perf_counter() - t0, items=1)
+                yield self._put_output(write_queue, item, output)
+                continue
+            pending.append((item, self.pool.apply_async(self.compute_function, (item, inputs))))
+            #プールで同時に計算する数は in_flight までにする
+            while len(pending) >= self.in_flight:
+                yield self._get_pool_output(write_queue, *pending.popleft())
+        while len(pending) > 0:
+            yield self._get_pool_output(write_queue, *pending.popleft())
+
+        write_queue.put(_END)
+        writer_thread.join()
+        wall = time.perf_counter() - start
+        self.metrics = self.summarize(wall)
+        if self.write_error is not None:
+            raise self.write_error
+        return
+
+
+    def _read_loop(self, item_iter, item_lock, read_queue, running):
+        read = self.stage_metrics["read"]
+        while True:
+            with item_lock:
+                item = next(item_iter, _END)
+            if item is _END:
+                break
+            t0 = time.perf_counter()
+            try:
+                inputs = self.read_function(item)
+            except Exception as e:
+                inputs = _Failure(e)
+            t1 = time.perf_counter()
+            read_queue.put((item, inputs))
+            read.add(busy=t1 - t0, stall=time.perf_counter() - t1, items=1)
+            self.read_queue_metrics.sample(read_queue.qsize())
+        #最後に終わった読み込みスレッドが終わりの印を入れる
+        with item_lock:
+            running[0] -= 1
+            last = (running[0] == 0)
+        if last:
+            read_queue.put(_END)
+        return 0
+
+
+    def _put_output(self, write_queue, item, output):
+        t0 = time.perf_counter()
+        write_queue.put((item, output))
+        self.stage_metrics["compute"].add(stall=time.perf_counter() - t0)
+        self.write_queue_metrics.sample(write_queue.qsize())
+        return output
+
+
+    def _get_pool_output(self, write_queue, item, result):
+        t0 = time.perf_counter()
+        output = result.get()
+        self.stage_metrics["compute"].add(busy=time.perf_counter() - t0, items=1)
+        return self._put_output(write_queue, item, output)
+
+
+    def _write_loop(self, write_queue):
+        write = self.stage_metrics["write"]
+        finished = False
+        while not finished:
+            t0 = time.perf_counter()
+            entries = [write_queue.get()]
+            write.add(wait=time.perf_counter() - t0)
+            #待っている出力をまとめて書く
+            while True:
+                try:
+                    entries.append(write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if entries[-1] is _END:
+                finished = True
+                entries.pop()
+            if len(entries) == 0 or self.write_error is not None:
+                continue
+            t0 = time.perf_counter()
+            try:
+                self.write_function(entries)
+            except Exception as e:
+                self.write_error = e
+            write.add(busy=time.perf_counter() - t0, items=len(entries))
+        return 0
+
+
+    def summarize(self, wall):
+        """
+        Get metrics of stages and queues. The bottleneck is the stage with the highest utilization.
+        """
+        stages = dict((name, metrics.summary(wall)) for name, metrics in self.stage_metrics.items())
+        return {
+            "wall" : wall,
+            "stages" : stages,
+            "queues" : {"read" : self.read_queue_metrics.summary(), "write" : self.write_queue_metrics.summary()},
+            "bottleneck" : max(stages, key=lambda name: stages[name]["utilization"])
+        }
+
+
+def print_metrics(metrics):
+    """
+    Print metrics of Pipeline.run.
+    """
+    print("Pipeline: wall time {:.3f} sec, bottleneck = {}".format(metrics["wall"], metrics["bottleneck"]))
+    print("{:<16} {:>8} {:>8} {:>10} {:>10} {:>10} {:>12}".format("stage [sec]", "threads", "items", "busy", "wait", "stall", "utilization"))
+    for name, value in metrics["stages"].items():
+        print("{:<16} {:>8} {:>8} {:>10.4f} {:>10.4f} {:>10.4f} {:>12.3f}".format(
+            name, value["threads"], value["items"], value["busy"], value["wait"], value["stall"], value["utilization"]))
+    print("{:<16} {:>8} {:>10} {:>10}".format("queue", "capacity", "mean", "max"))
+    for name, value in metrics["queues"].items():
+        print("{:<16} {:>8} {:>10.2f} {:>10}".format(name, value["capacity"], value["mean_depth"], value["max_depth"]))
+    return 0
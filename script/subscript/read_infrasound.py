@@ -0,0 +1,47 @@
+import io
+import numpy as np
+import pandas as pd
+
+def read_infrasound_csv(csv_fpath, column="InfAC", dtype=np.float64):
+    """
+    Read one column of preprocessed infrasound csv as contiguous numpy array.
+    Other columns such as SensorTimeStamp are not parsed.
+    """
+    df = pd.read_csv(csv_fpath, usecols=[column], dtype={column: dtype}, engine="c")
+    return np.ascontiguousarray(df[column].to_numpy(dtype=dtype))
+
+
+def read_infrasound_csv_bulk(csv_fpaths, column="InfAC", dtype=np.float64):
+    """
+    Read one column of all csv files of one place in one pd.read_csv call.
+    Rows of the files are joined in memory under the header of the first file, so the parser runs once per place.
+    If headers differ or the rows of a file can not be counted (e.g. blank lines), each file is read by read_infrasound_csv.
+    Return list of arrays (contiguous views of one buffer) in the order of csv_fpaths.
+    """
+    if len(csv_fpaths) == 0:
+        return []
+    header = None
+    bodies = []
+    lengths = []
+    for csv_fpath in csv_fpaths:
+        with open(csv_fpath, 'rb') as f:
+            text = f.read()
+        line_end = text.find(b"\n")
+        if line_end < 0:
+            line_end = len(text)
+        if header is None:
+            header = text[:line_end].rstrip(b"\r")
+        elif text[:line_end].rstrip(b"\r") != header:
+            return [read_infrasound_csv(csv_fpath, column, dtype) for csv_fpath in csv_fpaths]
+        body = text[line_end + 1:]
+        if len(body) > 0 and not body.endswith(b"\n"):
+            body += b"\n"
+        bodies.append(body)
+        lengths.append(body.count(b"\n"))
+    df = pd.read_csv(io.BytesIO(header + b"\n" + b"".join(bodies)), usecols=[column], dtype={column: dtype}, engine="c")
+    buffer = np.ascontiguousarray(df[column].to_numpy(dtype=dtype))
+    #空行は読み飛ばされるので、行数が合わなければファイルごとに読む
+    if len(buffer) != sum(lengths):
+        return [read_infrasound_csv(csv_fpath, column, dtype) for csv_fpath in csv_fpaths]
+    offsets = np.cumsum([0] + lengths)
+    return [buffer[offsets[i]:offsets[i + 1]] for i in range(len(csv_fpaths))]
@@ -0,0 +1,128 @@
+import os
+import json
+import uuid
+import numpy as np
+from subscript import operate_fpath
+from subscript import read_infrasound
+
+STORE_VERSION = 1
+STORE_DTYPE = np.dtype(np.float64) #csv の値をそのまま保持する
+
+
+def read_signal(location):
+    """
+    Open one recording of signal store as read-only memmap slice. Nothing is read until samples are used.
+    location = (bin file path, offset, length) from SignalStore.update_shard. offset and length are in samples.
+    """
+    bin_fpath, offset, length = location
+    if length == 0:
+        return np.zeros(0, dtype=STORE_DTYPE)
+    return np.memmap(bin_fpath, dtype=STORE_DTYPE, mode='r', offset=offset * STORE_DTYPE.itemsize, shape=(length,))
+
+
+class SignalStore():
+    """
+    Binary store of preprocessed infrasound signals, converted once from csv files.
+    store_fpath/<threshold>/<place>.<build id>.bin : contiguous float64 samples of all recordings of one shard
+    store_fpath/<threshold>/<place>.json           : bin file name, and path, size, mtime, offset and length of each csv
+    A csv file is parsed again only when its size or mtime changes. Unchanged recordings are copied from the old bin file.
+    New bin file is written before its index, so the index always points to a complete bin file.
+    """
+    def __init__(self, store_fpath):
+        self.store_fpath = store_fpath
+
+
+    def index_fpath(self, shard_name):
+        return os.path.join(self.store_fpath, shard_name + ".json")
+
+
+    def read_index(self, shard_name):
+        """
+        Get index of shard, or None if the shard is not converted.
+        """
+        try:
+            with open(self.index_fpath(shard_name), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if index.get("version") != STORE_VERSION or index.get("dtype") != STORE_DTYPE.name:
+            return None
+        if not os.path.exists(os.path.join(os.path.dirname(self.index_fpath(shard_name)), index["bin"])):
+            return None
+        return index
+
+
+    def update_shard(self, shard_name, csv_fpaths, needed=None):
+        """
+        Convert csv files of one shard (threshold/place) if some of them are new or changed.
+        New or changed csv files are parsed together by read_infrasound.read_infrasound_csv_bulk.
+        needed is a bool of each csv file (default: all True). A csv file not needed, e.g. its features are cached,
+        is not parsed, but it is kept in the store if it is already converted and unchanged.
+        Return location (bin file path, offset, length) of each recording in the order of csv_fpaths (None if it is not
+        in the store), and number of parsed csv files.
+        """
+        if needed is None:
+            needed = [True] * len(csv_fpaths)
+        index = self.read_index(shard_name)
+        shard_fpath = os.path.dirname(self.index_fpath(shard_name))
+        old_entries = {}
+        if index is not None:
+            old_entries = dict((entry["fpath"], entry) for entry in index["recordings"])
+
+        #サイズと更新時刻が変わっていない記録は古い bin ファイルから使う
+        sources = []
+        for csv_fpath, need in zip(csv_fpaths, needed):
+            stat = os.stat(csv_fpath)
+            entry = old_entries.get(os.path.abspath(csv_fpath))
+            if entry is not None and (entry["size"], entry["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+                entry = None
+            sources.append([csv_fpath, stat, entry, need])
+
+        #必要な記録がすべて変換済みで、索引に余分な記録がなければ書き直さない
+        kept = [entry for csv_fpath, stat, entry, need in sources if entry is not None]
+        if all(entry is not None or not need for csv_fpath, stat, entry, need in sources) \
+                and (index is None or [entry["fpath"] for entry in index["recordings"]] == [entry["fpath"] for entry in kept]):
+            if index is None:
+                return [None] * len(sources), 0
+            bin_fpath = os.path.join(shard_fpath, index["bin"])
+            return [(bin_fpath, entry["offset"], entry["length"]) if entry is not None else None
+                    for csv_fpath, stat, entry, need in sources], 0
+
+        os.makedirs(shard_fpath, exist_ok=True)
+        bin_fname = os.path.basename(shard_name) + "." + uuid.uuid4().hex[:8] + ".bin"
+        bin_fpath = os.path.join(shard_fpath, bin_fname)
+        #変換する csv は観測点ごとにまとめて一度に読む
+        parse_fpaths = [csv_fpath for csv_fpath, stat, entry, need in sources if entry is None and need]
+        parsed_signals = iter(read_infrasound.read_infrasound_csv_bulk(parse_fpaths, dtype=STORE_DTYPE))
+        recordings = []
+        locations = []
+        offset = 0
+        with operate_fpath.atomic_open(bin_fpath, 'wb') as f:
+            for csv_fpath, stat, entry, need in sources:
+                if entry is None and not need:
+                    locations.append(None)
+                    continue
+                if entry is not None:
+                    signal = read_signal((os.path.join(shard_fpath, index["bin"]), entry["offset"], entry["length"]))
+                else:
+                    signal = next(parsed_signals)
+                f.write(np.ascontiguousarray(signal, dtype=STORE_DTYPE).tobytes())
+                recordings.append({
+                    "fpath" : os.path.abspath(csv_fpath),
+                    "size" : stat.st_size,
+                    "mtime_ns" : stat.st_mtime_ns,
+                    "offset" : offset,
+                    "length" : len(signal)
+                })
+                locations.append((bin_fpath, offset, len(signal)))
+                offset += len(signal)
+
+        new_index = {"version" : STORE_VERSION, "dtype" : STORE_DTYPE.name, "bin" : bin_fname, "recordings" : recordings}
+        with operate_fpath.atomic_open(self.index_fpath(shard_name), 'w') as f:
+            json.dump(new_index, f, indent=4, ensure_ascii=False)
+        if index is not None:
+            try:
+                os.remove(os.path.join(shard_fpath, index["bin"]))
+            except OSError:
+                pass
+        return locations, len(parse_fpaths)
@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+import numpy as np
+from subscript import operate_fpath
+
+EVICT_RATIO = 0.9 #追い出す時は max_bytes のこの割合まで減らし、次の走査までの余裕を作る
+_caches = {} #プロセスごとの SpectrumCache
+
+
+def spectrum_key(content_hash, fs, p_filter, nframe, ov, dtype="float64", padding=False, highpass=False):
+    """
+    Get cache key of spectra. Record length N is fixed by the content hash.
+    """
+    text = json.dumps([content_hash, fs, p_filter, nframe, ov, np.dtype(dtype).name, padding, highpass])
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def get_cache(cache_fpath, max_bytes):
+    """
+    Get SpectrumCache of this process, so its running size total is kept over tasks.
+    """
+    if (cache_fpath, max_bytes) not in _caches:
+        _caches[(cache_fpath, max_bytes)] = SpectrumCache(cache_fpath, max_bytes)
+    return _caches[(cache_fpath, max_bytes)]
+
+
+class SpectrumCache():
+    """
+    On-disk cache of amplitude spectra of each recording, bounded by max_bytes with LRU eviction.
+    Each entry is cache_fpath/<key>.npz with N, record spectrum (1 x N/2) and frame spectra (frames x nframe/2).
+    The spectra do not depend on numChannels, fo, mel and cutpoint, so any filter bank runs from them.
+    File mtime is the last use time. Several processes can share one cache folder.
+    Size of the folder is scanned once and then counted at each put. Over max_bytes, the folder is scanned again and
+    entries are removed down to EVICT_RATIO * max_bytes, so the scan runs once per many puts.
+    Puts of other processes are found at the next scan, so the folder can be a little over max_bytes until then.
+    """
+    def __init__(self, cache_fpath, max_bytes):
+        self.cache_fpath = cache_fpath
+        self.max_bytes = max_bytes
+        self.total = None #フォルダの大きさの見積もり。None なら走査していない
+        os.makedirs(cache_fpath, exist_ok=True)
+
+
+    def entry(self, key):
+        return os.path.join(self.cache_fpath, key + ".npz")
+
+
+    def get(self, key):
+        """
+        Get spectra dict {"N", "record", "frames"}, or None if not cached.
+        """
+        try:
+            with np.load(self.entry(key)) as npz:
+                spectra = {"N" : int(npz["N"]), "record" : npz["record"], "frames" : npz["frames"]}
+            os.utime(self.entry(key))
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        return spectra
+
+
+    def put(self, key, spectra):
+        """
+        Store spectra and evict least recently used entries if the folder is over max_bytes.
+        """
+        with operate_fpath.atomic_open(self.entry(key), 'wb') as f:
+            np.savez(f, N=spectra["N"], record=spectra["record"], frames=spectra["frames"])
+        if self.total is not None:
+            self.total += os.path.getsize(self.entry(key))
+        if self.total is None or self.total > self.max_bytes:
+            self.evict()
+        return 0
+
+
+    def evict(self):
+        """
+        Scan the folder and remove least recently used entries until total size is under EVICT_RATIO * max_bytes
+        if it is over max_bytes.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_fpath):
+            if entry.name.endswith(".npz"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for mtime, size, fpath in entries)
+        limit = self.max_bytes * EVICT_RATIO if total > self.max_bytes else self.max_bytes
+        for mtime, size, fpath in sorted(entries):
+            if total <= limit:
+                break
+            try:
+                os.remove(fpath)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.total = total
+        return 0